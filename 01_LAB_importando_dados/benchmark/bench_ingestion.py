@@ -0,0 +1,347 @@
+# ----------------------------------------------------------------
+# BENCHMARK DE INGESTÃO - LAB 01
+# ----------------------------------------------------------------
+# Mede como a carga do lab01_carga_csv.py escala com o volume:
+#   * gera versões sintéticas dos seis CSV em fatores de escala
+#     configuráveis, com as mesmas colunas, formatação e cardinalidades
+#     dos arquivos reais de dados/ (linhas reais reamostradas; só as
+#     chaves naturais são regeradas, únicas e com zeros à esquerda);
+#   * carrega cada arquivo com ingestion.load_entity em um Spark local
+#     (modos "spark", "pandas" e "pandas_chunked"), gravando em Delta;
+#   * reporta linhas/s, MB/s, pico de memória do driver (processo Python
+#     e JVM) e o tempo de cada etapa (read, convert, write) em JSON.
+#
+#   python bench_ingestion.py --scales 1,10,100 --output report.jsonl
+#
+# Com --output terminado em .jsonl o relatório é acrescentado como uma
+# linha, para acompanhar a evolução entre execuções.
+#
+# Requer: pyspark, delta-spark, pandas, pyarrow, psutil (e Java).
+
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LAB_DIR = os.path.join(HERE, "..")
+DEFAULT_SOURCE = os.path.join(HERE, "..", "..", "dados")
+
+sys.path.insert(0, LAB_DIR)
+
+from ingestion import ENTITIES, INGESTION_MODES, build_manifest, load_entity  # noqa: E402
+
+CATALOG_NAME = "spark_catalog"
+SCHEMA_NAME = "bench_ingestion"
+
+# empresas_sp.csv não é versionado em dados/: o layout abaixo (estabelecimentos
+# de SP com códigos de natureza, CNAE e município das outras entidades) é uma
+# aproximação, lida como texto como no pipeline real (schema None).
+EMPRESAS_SP_ROWS = 10000
+EMPRESAS_SP_SITUACOES = ("ATIVA", "BAIXADA", "INAPTA", "SUSPENSA", "NULA")
+
+GENERATION_CHUNK_ROWS = 500_000
+
+
+# ----------------------------------------------------------------
+# DADOS SINTÉTICOS
+# ----------------------------------------------------------------
+
+def read_real(source_dir: str, entity: str):
+    """CSV real como texto (a formatação original de cada célula é mantida)
+    e se o arquivo tem BOM, para gravar a versão sintética igual."""
+    path = os.path.join(source_dir, f"{entity}.csv")
+    with open(path, "rb") as f:
+        bom = f.read(3) == b"\xef\xbb\xbf"
+    real = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    return real, bom
+
+
+def key_width(values: pd.Series, rows: int) -> int:
+    """Largura do código: a do arquivo real, ou mais dígitos se não couberem as chaves."""
+    return max(int(values.str.len().max()), len(str(rows)))
+
+
+def empresas_sp_base(source_dir: str, rows: int, rng) -> pd.DataFrame:
+    faturamento, _ = read_real(source_dir, "faturamento")
+    cnae, _ = read_real(source_dir, "cnae")
+    naturezas, _ = read_real(source_dir, "naturezas")
+    municipios, _ = read_real(source_dir, "municipios")
+
+    def pick(values):
+        return rng.choice(values.to_numpy(), rows)
+
+    return pd.DataFrame({
+        "cnpj": "",                                         # regerado como chave
+        "razao_social": [f"EMPRESA SINTETICA {i}" for i in range(rows)],
+        "cod_natureza": pick(naturezas["codigo"]),
+        "cod_cnae": pick(cnae["cod_cnae"]),
+        "cod_municipio": pick(municipios["cod_municipio"]),
+        "uf": "SP",
+        "bairro": pick(faturamento["bairro"]),
+        "situacao": rng.choice(EMPRESAS_SP_SITUACOES, rows),
+    })
+
+
+def generate_entity(source_dir: str, target_dir: str, entity: str, natural_key: list, scale: float, seed: int) -> dict:
+    """Grava <target_dir>/<entity>.csv com round(linhas reais * scale) linhas.
+
+    As linhas são reamostradas com reposição do arquivo real, então cada
+    coluna mantém os valores (e a cardinalidade) reais e as correlações
+    entre colunas (bairro x CEP x coordenadas...). A chave natural é
+    regerada sequencialmente para continuar única.
+    """
+    rng = np.random.default_rng(seed)
+    if entity == "empresas_sp":
+        real, bom = empresas_sp_base(source_dir, EMPRESAS_SP_ROWS, rng), False
+        natural_key = ["cnpj"]
+    else:
+        real, bom = read_real(source_dir, entity)
+    rows = max(1, round(len(real) * scale))
+
+    key = natural_key[0] if natural_key else None
+    numeric_key = key is not None and real[key].str.fullmatch(r"[1-9]\d*").all()
+    width = 14 if entity == "empresas_sp" else key_width(real[key], rows) if key else 0
+
+    path = os.path.join(target_dir, f"{entity}.csv")
+    started = time.perf_counter()
+    with open(path, "w", encoding="utf-8-sig" if bom else "utf-8", newline="") as f:
+        for offset in range(0, rows, GENERATION_CHUNK_ROWS):
+            size = min(GENERATION_CHUNK_ROWS, rows - offset)
+            chunk = real.iloc[rng.integers(0, len(real), size)].reset_index(drop=True)
+            if key:
+                ids = np.arange(offset + 1, offset + size + 1)
+                chunk[key] = ids.astype(str) if numeric_key else pd.Series(ids.astype(str)).str.zfill(width)
+            chunk.to_csv(f, index=False, header=offset == 0, quoting=csv.QUOTE_MINIMAL)
+    return {
+        "entity": entity,
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "source_cardinality": {c: int(real[c].nunique()) for c in real.columns if c != key},
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def generate_scale(source_dir: str, target_dir: str, scale: float, seed: int) -> list:
+    os.makedirs(target_dir, exist_ok=True)
+    return [generate_entity(source_dir, target_dir, entry["entity"], entry["natural_key"], scale, seed + i)
+            for i, entry in enumerate(ENTITIES)]
+
+
+# ----------------------------------------------------------------
+# SPARK LOCAL
+# ----------------------------------------------------------------
+
+def build_spark(work_dir: str, driver_memory: str, cores: str):
+    from delta import configure_spark_with_delta_pip
+    from pyspark.sql import SparkSession
+
+    builder = (
+        SparkSession.builder
+        .master(f"local[{cores}]")
+        .appName("bench_ingestion")
+        .config("spark.driver.memory", driver_memory)
+        .config("spark.sql.warehouse.dir", os.path.join(work_dir, "warehouse"))
+        .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
+        .config("spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog")
+        .config("spark.sql.sources.default", "delta")          # saveAsTable grava Delta, como no Databricks
+        .config("spark.ui.enabled", "false")
+    )
+    spark = configure_spark_with_delta_pip(builder).getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    spark.sql(f"CREATE DATABASE IF NOT EXISTS {CATALOG_NAME}.{SCHEMA_NAME}")
+    return spark
+
+
+class MemorySampler:
+    """Pico de RSS do processo Python e dos filhos (a JVM do Spark local) e
+    do heap usado da JVM, amostrados em segundo plano."""
+
+    def __init__(self, spark, interval: float = 0.1):
+        import psutil
+
+        self.process = psutil.Process()
+        self.runtime = spark.sparkContext._jvm.java.lang.Runtime.getRuntime()
+        self.interval = interval
+        self.peak = {"python_rss": 0, "jvm_rss": 0, "jvm_heap": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        self.peak["python_rss"] = max(self.peak["python_rss"], self.process.memory_info().rss)
+        jvm_rss = 0
+        for child in self.process.children(recursive=True):
+            try:
+                jvm_rss += child.memory_info().rss
+            except Exception:
+                pass   # processo filho encerrado entre a listagem e a leitura
+        self.peak["jvm_rss"] = max(self.peak["jvm_rss"], jvm_rss)
+        heap = self.runtime.totalMemory() - self.runtime.freeMemory()
+        self.peak["jvm_heap"] = max(self.peak["jvm_heap"], heap)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def report(self) -> dict:
+        return {f"{name}_peak_mb": round(value / 2**20, 1) for name, value in self.peak.items()}
+
+
+# ----------------------------------------------------------------
+# EXECUÇÃO
+# ----------------------------------------------------------------
+
+def scan_seconds(spark, entry: dict) -> float:
+    """No modo "spark" a leitura é lazy (o parse acontece dentro da gravação):
+    uma passada extra com o formato "noop" mede só o parse do CSV."""
+    from ingestion import read_csv_spark
+
+    started = time.perf_counter()
+    read_csv_spark(spark, entry["source"], entry["schema"]).write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - started
+
+
+def bench_entity(spark, entry: dict, landing_dir: str, mode: str, args, generated: dict) -> dict:
+    result = {"entity": entry["entity"], "mode": mode, "rows": generated["rows"], "csv_bytes": generated["bytes"]}
+    timings = {}
+    # tabela nova em todos os modos: todos medem o mesmo caminho de gravação
+    # (CREATE com TBLPROPERTIES), e não um CREATE contra overwrites
+    spark.sql(f"DROP TABLE IF EXISTS {entry['table']}")
+    try:
+        with MemorySampler(spark) as sampler:
+            loaded = load_entity(spark, entry, landing_dir, mode, memory_budget_mb=args.memory_budget_mb,
+                                 timings=timings)
+        seconds = sum(timings.values())
+        result.update({
+            "status": "ok",
+            "error": None,
+            "rows": loaded["rows"],
+            "seconds": round(seconds, 3),
+            "stages": {stage: round(timings.get(stage, 0.0), 3) for stage in ("read", "convert", "write")},
+            "rows_per_s": round(loaded["rows"] / seconds, 1) if seconds else None,
+            "mb_per_s": round(generated["bytes"] / 2**20 / seconds, 2) if seconds else None,
+            "memory": sampler.report(),
+        })
+        if mode == "spark" and args.scan:
+            result["stages"]["scan"] = round(scan_seconds(spark, entry), 3)
+    except Exception as e:
+        # o pico de memória da falha (ex.: OOM no modo "pandas") também é informativo
+        result.update({"status": "erro", "error": str(e)[:500],
+                       "stages": {stage: round(s, 3) for stage, s in timings.items()}})
+    return result
+
+
+def bench_scale(spark, scale: float, args) -> dict:
+    data_dir = os.path.join(args.work_dir, f"dados_x{scale:g}")
+    generated = {g["entity"]: g for g in generate_scale(args.source, data_dir, scale, args.seed)}
+    manifest = build_manifest(CATALOG_NAME, SCHEMA_NAME, data_dir)
+    landing_dir = os.path.join(args.work_dir, "landing")
+
+    # Entidades em sequência (e não em paralelo como load_all) para que
+    # tempo e memória de cada carga não se misturem
+    results = []
+    for mode in args.modes.split(","):
+        for entry in manifest:
+            results.append(bench_entity(spark, entry, landing_dir, mode, args, generated[entry["entity"]]))
+
+    if not args.keep_data:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return {"scale": scale, "generated": list(generated.values()), "results": results}
+
+
+def environment(spark, args) -> dict:
+    import psutil
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spark": spark.version,
+        "cpu_count": os.cpu_count(),
+        "memory_total_mb": round(psutil.virtual_memory().total / 2**20),
+        "spark_master": spark.sparkContext.master,
+        "driver_memory": args.driver_memory,
+    }
+
+
+def print_report(result: dict):
+    print(f"\n== escala x{result['scale']:g} ==")
+    print(f"{'modo':<16}{'entidade':<13}{'linhas':>12}{'s':>9}{'read':>8}{'convert':>9}{'write':>8}"
+          f"{'linhas/s':>12}{'jvm MB':>9}{'py MB':>8}")
+    for r in result["results"]:
+        if r["status"] != "ok":
+            print(f"{r['mode']:<16}{r['entity']:<13}{r['rows']:>12,}  ERRO: {r['error'][:80]}")
+            continue
+        stages, memory = r["stages"], r["memory"]
+        print(f"{r['mode']:<16}{r['entity']:<13}{r['rows']:>12,}{r['seconds']:>9.2f}{stages['read']:>8.2f}"
+              f"{stages['convert']:>9.2f}{stages['write']:>8.2f}{r['rows_per_s']:>12,.0f}"
+              f"{memory['jvm_rss_peak_mb']:>9.0f}{memory['python_rss_peak_mb']:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingestão dos CSV do Lab 01 em Spark local.")
+    parser.add_argument("--scales", default="1,10,100", help="fatores de escala sobre as linhas reais, separados por vírgula")
+    parser.add_argument("--modes", default=",".join(INGESTION_MODES), help=f"modos de ingestão ({', '.join(INGESTION_MODES)})")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="diretório com os CSV reais (modelo dos dados)")
+    parser.add_argument("--work-dir", help="diretório para CSV gerados e tabelas (padrão: temporário)")
+    parser.add_argument("--keep-data", action="store_true", help="mantém os CSV gerados")
+    parser.add_argument("--memory-budget-mb", type=int, default=256, help="orçamento do modo pandas_chunked")
+    parser.add_argument("--driver-memory", default="4g", help="spark.driver.memory")
+    parser.add_argument("--cores", default="*", help="núcleos do Spark local (local[N])")
+    parser.add_argument("--scan", action="store_true", help='modo "spark": mede também uma passada só de leitura')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="relatório JSON (.jsonl acrescenta uma linha; padrão: stdout)")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        if mode not in INGESTION_MODES:
+            parser.error(f"modo inválido: {mode}")
+    args.work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_ingestion_")
+
+    spark = build_spark(args.work_dir, args.driver_memory, args.cores)
+    results = []
+    for scale in (float(s) for s in args.scales.split(",")):
+        result = bench_scale(spark, scale, args)
+        print_report(result)
+        results.append(result)
+
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(spark, args),
+              "args": vars(args), "results": results}
+    spark.stop()
+    if not args.output:
+        print(json.dumps(report, indent=2))
+    elif args.output.endswith(".jsonl"):
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
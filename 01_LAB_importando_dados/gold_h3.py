@@ -0,0 +1,368 @@
+# ----------------------------------------------------------------
+# CAMADA GOLD H3 - LAB 01
+# ----------------------------------------------------------------
+# Módulo auxiliar do notebook lab01_gold_h3.py.
+# Atribui células H3 aos clientes de faturamento de forma vetorizada
+# e agrega a inadimplência por célula, gênero, bairro e faixa de dívida.
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from pyspark.sql import functions as F
+from pyspark.sql.types import LongType
+
+# Resoluções gravadas na gold (a primeira é a mais fina, base das demais)
+H3_RESOLUTIONS = (9, 8, 7)
+
+DIMENSIONS = ["genero_cliente", "bairro", "faixa_divida"]
+
+# Layout físico das tabelas gold (layout.optimize_table): o App lê a gold por
+# faixas de h3_09_id (área visível do mapa) e o rollup por resolução + célula
+GOLD_LAYOUT = {"cluster_by": ["h3_09_id"], "statistics": ["h3_09_id", *DIMENSIONS]}
+ROLLUP_LAYOUT = {"cluster_by": ["h3_resolucao", "h3_id"], "statistics": ["h3_resolucao", "h3_id", *DIMENSIONS]}
+CUBE_LAYOUT = {"cluster_by": [], "statistics": "all"}
+
+# Layout do índice H3 (64 bits): resolução nos bits 52-55 e um dígito de
+# 3 bits por resolução (1..15); dígitos abaixo da resolução valem 7.
+H3_RES_OFFSET = 52
+H3_RES_MASK = 0xF << H3_RES_OFFSET
+
+
+def h3_column(resolution: int) -> str:
+    return f"h3_{resolution:02d}_id"
+
+
+def parent_mask(resolution: int) -> int:
+    """Bits dos dígitos abaixo de `resolution` (todos em 1 no pai)."""
+    return (1 << (3 * (15 - resolution))) - 1
+
+
+@F.pandas_udf(LongType())
+def _latlng_to_cell(lat: pd.Series, lng: pd.Series, resolution: pd.Series) -> pd.Series:
+    # Executa por lote Arrow; h3 gera o id inteiro direto (sem passar por string)
+    from h3.api import basic_int as h3_int
+
+    res = int(resolution.iloc[0]) if len(resolution) else 0
+    lat_v = lat.to_numpy(dtype="float64", na_value=np.nan)
+    lng_v = lng.to_numpy(dtype="float64", na_value=np.nan)
+    valid = ~(np.isnan(lat_v) | np.isnan(lng_v))
+
+    cells = np.zeros(len(lat_v), dtype="int64")
+    cells[valid] = [h3_int.latlng_to_cell(a, b, res) for a, b in zip(lat_v[valid], lng_v[valid])]
+    # IntegerArray evita passar por float (ids H3 não cabem em 53 bits)
+    return pd.Series(pd.arrays.IntegerArray(cells, ~valid))
+
+
+def h3_cell(lat_col: str, lng_col: str, resolution: int):
+    """Célula H3 (BIGINT) calculada em lotes Arrow por uma pandas UDF."""
+    return _latlng_to_cell(F.col(lat_col), F.col(lng_col), F.lit(resolution))
+
+
+def h3_to_parent(cell_col, resolution: int):
+    """Pai H3 por operações de bits nativas do Spark (sem UDF)."""
+    cell = F.col(cell_col) if isinstance(cell_col, str) else cell_col
+    return (
+        cell.bitwiseAND(F.lit(~H3_RES_MASK).cast("bigint"))
+        .bitwiseOR(F.lit(resolution << H3_RES_OFFSET).cast("bigint"))
+        .bitwiseOR(F.lit(parent_mask(resolution)).cast("bigint"))
+    )
+
+
+def with_h3(s_df, resolutions=H3_RESOLUTIONS, lat_col: str = "latitude", lng_col: str = "longitude"):
+    """Adiciona uma coluna h3_NN_id por resolução: a mais fina pela UDF,
+    as demais derivadas dela (cell_to_parent) sem recalcular a geometria."""
+    finest, *parents = sorted(resolutions, reverse=True)
+    s_df = s_df.withColumn(h3_column(finest), h3_cell(lat_col, lng_col, finest))
+    for res in parents:
+        s_df = s_df.withColumn(h3_column(res), h3_to_parent(h3_column(finest), res))
+    return s_df
+
+
+def build_gold_h3(faturamento_df, resolutions=H3_RESOLUTIONS):
+    """Gold no grão da resolução mais fina, com as chaves dos pais.
+
+    Mantém o layout do LAB 04 (h3_09_id, genero_cliente, bairro,
+    faixa_divida, contagem_clientes, valor_inadimplencia) e acrescenta
+    h3_08_id / h3_07_id para agregações em resoluções menores.
+    """
+    h3_cols = [h3_column(r) for r in sorted(resolutions, reverse=True)]
+    return (
+        with_h3(faturamento_df.where(F.col("ind_inadimplente") == "S"), resolutions)
+        .where(F.col(h3_cols[0]).isNotNull())
+        .groupBy(*h3_cols, *DIMENSIONS)
+        .agg(
+            F.count("num_cliente").alias("contagem_clientes"),
+            F.sum("val_divida").alias("valor_inadimplencia"),
+        )
+    )
+
+
+def build_rollup(gold_df, resolutions=H3_RESOLUTIONS):
+    """Agregados da gold em cada resolução (formato longo: h3_resolucao, h3_id)."""
+    levels = [
+        gold_df.groupBy(F.col(h3_column(res)).alias("h3_id"), *DIMENSIONS)
+        .agg(
+            F.sum("contagem_clientes").alias("contagem_clientes"),
+            F.sum("valor_inadimplencia").alias("valor_inadimplencia"),
+        )
+        .select(F.lit(res).alias("h3_resolucao"), "h3_id", *DIMENSIONS, "contagem_clientes", "valor_inadimplencia")
+        for res in resolutions
+    ]
+    rollup = levels[0]
+    for level in levels[1:]:
+        rollup = rollup.unionByName(level)
+    return rollup
+
+
+# ----------------------------------------------------------------
+# GRAVAÇÃO INCREMENTAL DA GOLD
+# ----------------------------------------------------------------
+# O App lê o Change Data Feed da gold para atualizar seus caches só com
+# as linhas alteradas: regravar a tabela inteira a cada execução faria
+# do feed um delete + insert de tudo. A gold é criada uma vez (com CDF)
+# e depois recebe MERGE apenas dos grupos que mudaram.
+
+METRICS = ["contagem_clientes", "valor_inadimplencia"]
+
+# Somas de ponto flutuante variam na ordem da agregação: diferenças
+# abaixo de meio centavo não contam como mudança
+VALUE_TOLERANCE = 0.005
+
+GOLD_PROPERTIES = {"delta.enableChangeDataFeed": "true"}
+
+
+def gold_changes(gold_df, current_df):
+    """Grupos novos, alterados ou removidos entre a gold calculada e a gravada.
+
+    Linhas com _excluir = true saíram de faturamento; as demais trazem
+    as métricas novas do grupo.
+    """
+    keys = [c for c in gold_df.columns if c not in METRICS]
+    on = None
+    for k in keys:
+        cond = F.col(f"s.`{k}`").eqNullSafe(F.col(f"t.`{k}`"))
+        on = cond if on is None else on & cond
+
+    source_missing = F.col("s.contagem_clientes").isNull()
+    target_missing = F.col("t.contagem_clientes").isNull()
+    same_value = F.coalesce(
+        F.abs(F.col("s.valor_inadimplencia") - F.col("t.valor_inadimplencia")) <= VALUE_TOLERANCE,
+        F.col("s.valor_inadimplencia").isNull() & F.col("t.valor_inadimplencia").isNull(),
+    )
+    changed = (
+        source_missing | target_missing
+        | (F.col("s.contagem_clientes") != F.col("t.contagem_clientes")) | ~same_value
+    )
+    return (
+        gold_df.alias("s").join(current_df.alias("t"), on, "full_outer")
+        .where(changed)
+        .select(
+            *[F.coalesce(F.col(f"s.`{k}`"), F.col(f"t.`{k}`")).alias(k) for k in keys],
+            *[F.col(f"s.`{m}`").alias(m) for m in METRICS],
+            source_missing.alias("_excluir"),
+        )
+    )
+
+
+def write_gold(spark, gold_df, gold_table: str) -> dict:
+    """Grava a gold criando uma nova versão Delta só quando algo mudou.
+
+    Na primeira execução cria a tabela com Change Data Feed; nas seguintes
+    aplica um MERGE apenas dos grupos alterados (nenhum commit se nada
+    mudou). Se as colunas mudarem (ex.: outras resoluções H3) a tabela é
+    regravada, mantendo as propriedades.
+    """
+    from delta.tables import DeltaTable
+    from ingestion import set_missing_properties, written_rows
+
+    if not spark.catalog.tableExists(gold_table):
+        writer = gold_df.writeTo(gold_table).using("delta")
+        for key, value in GOLD_PROPERTIES.items():
+            writer = writer.tableProperty(key, value)
+        writer.create()
+        return {"action": "create", "rows_changed": written_rows(spark, gold_table)}
+
+    set_missing_properties(spark, gold_table, GOLD_PROPERTIES)   # tabelas criadas antes, sem CDF
+    current_df = spark.table(gold_table)
+    if set(current_df.columns) != set(gold_df.columns):
+        gold_df.write.mode("overwrite").option("overwriteSchema", "true").saveAsTable(gold_table)
+        return {"action": "overwrite", "rows_changed": written_rows(spark, gold_table)}
+
+    changes_df = gold_changes(gold_df, current_df).persist()
+    try:
+        rows_changed = changes_df.count()
+        if rows_changed:
+            keys = [c for c in gold_df.columns if c not in METRICS]
+            on = " AND ".join(f"t.`{k}` <=> s.`{k}`" for k in keys)
+            (
+                DeltaTable.forName(spark, gold_table).alias("t")
+                .merge(changes_df.alias("s"), on)
+                .whenMatchedDelete(condition="s._excluir")
+                .whenMatchedUpdate(set={m: f"s.`{m}`" for m in METRICS})
+                .whenNotMatchedInsert(condition="NOT s._excluir",
+                                      values={c: f"s.`{c}`" for c in gold_df.columns})
+                .execute()
+            )
+    finally:
+        changes_df.unpersist()
+    return {"action": "merge" if rows_changed else "skip", "rows_changed": rows_changed}
+
+
+# ----------------------------------------------------------------
+# CUBO DE AGREGADOS (KPIs DO APP)
+# ----------------------------------------------------------------
+# Tabela pequena com os totais por uf x cidade x gênero x bairro x faixa
+# de dívida: o App lê dela os KPIs e as listas dos filtros em vez de
+# somar as linhas de detalhe. É atualizada de forma incremental a partir
+# do Change Data Feed de faturamento (MERGE só dos grupos alterados).
+
+CUBE_DIMENSIONS = ["uf", "cidade", *DIMENSIONS]
+
+# Versão de faturamento já aplicada ao cubo: vai no userMetadata do próprio
+# commit de dados (MERGE ou overwrite), lido de volta do DESCRIBE HISTORY.
+# Dados e versão ficam no mesmo commit: uma falha no meio não reaplica o CDF.
+CUBE_VERSION_METADATA = "lakehouse.cubo.versao_origem="
+
+# Operações cujo Change Data Feed descreve todas as linhas alteradas.
+# Qualquer outra (overwrite, REPLACE, RESTORE...) no intervalo refaz o cubo.
+CHANGE_FEED_OPERATIONS = ("MERGE", "UPDATE", "DELETE", "OPTIMIZE", "SET TBLPROPERTIES")
+
+
+def cube_clients(faturamento_df):
+    """Mesmos clientes da gold: inadimplentes com coordenadas (célula H3 válida)."""
+    return faturamento_df.where(
+        (F.col("ind_inadimplente") == "S") & F.col("latitude").isNotNull() & F.col("longitude").isNotNull()
+    )
+
+
+def build_cube(faturamento_df):
+    return (
+        cube_clients(faturamento_df)
+        .groupBy(*CUBE_DIMENSIONS)
+        .agg(
+            F.count("num_cliente").alias("contagem_clientes"),
+            F.sum("val_divida").alias("valor_inadimplencia"),
+        )
+    )
+
+
+def build_cube_changes(changes_df):
+    """Variação de cada grupo do cubo a partir das linhas do Change Data Feed:
+    delete / update_preimage pesam -1, insert / update_postimage +1."""
+    sign = F.when(F.col("_change_type").isin("delete", "update_preimage"), -1).otherwise(1)
+    return (
+        cube_clients(changes_df)
+        .groupBy(*CUBE_DIMENSIONS)
+        .agg(
+            F.sum(F.when(F.col("num_cliente").isNotNull(), sign).otherwise(0)).cast("bigint").alias("contagem_clientes"),
+            # soma nula (todas as linhas sem val_divida) anularia o grupo do cubo no MERGE
+            F.coalesce(F.sum(sign * F.col("val_divida")), F.lit(0.0)).alias("valor_inadimplencia"),
+        )
+    )
+
+
+def table_version(spark, table_name: str) -> int:
+    return int(spark.sql(f"DESCRIBE HISTORY {table_name} LIMIT 1").collect()[0]["version"])
+
+
+def cube_source_version(spark, cube_table: str):
+    """Última versão de faturamento registrada em um commit do cubo (OPTIMIZE e
+    ANALYZE não têm userMetadata e são ignorados)."""
+    rows = (
+        spark.sql(f"DESCRIBE HISTORY {cube_table}")
+        .where(F.col("userMetadata").startswith(CUBE_VERSION_METADATA))
+        .orderBy(F.col("version").desc())
+        .select("userMetadata")
+        .limit(1)
+        .collect()
+    )
+    value = rows[0]["userMetadata"][len(CUBE_VERSION_METADATA):] if rows else None
+    return int(value) if value and value.isdigit() else None
+
+
+@contextmanager
+def commit_metadata(spark, metadata: str):
+    """userMetadata dos commits Delta feitos no bloco (configuração da sessão)."""
+    key = "spark.databricks.delta.commitInfo.userMetadata"
+    spark.conf.set(key, metadata)
+    try:
+        yield
+    finally:
+        spark.conf.unset(key)
+
+
+def replayable(spark, source_table: str, from_version: int, to_version: int) -> bool:
+    """True se o intervalo (from_version, to_version] só tem operações com CDF completo."""
+    history = (
+        spark.sql(f"DESCRIBE HISTORY {source_table}")
+        .where((F.col("version") > from_version) & (F.col("version") <= to_version))
+        .select("operation", "operationParameters")
+        .collect()
+    )
+    return all(
+        h["operation"] in CHANGE_FEED_OPERATIONS
+        or (h["operation"] == "WRITE" and (h["operationParameters"] or {}).get("mode") == "Append")
+        for h in history
+    )
+
+
+def merge_cube_changes(spark, cube_table: str, changes_df):
+    from delta.tables import DeltaTable
+
+    on = " AND ".join(f"t.`{d}` <=> s.`{d}`" for d in CUBE_DIMENSIONS)
+    (
+        DeltaTable.forName(spark, cube_table).alias("t")
+        .merge(changes_df.alias("s"), on)
+        .whenMatchedDelete(condition="t.contagem_clientes + s.contagem_clientes <= 0")
+        .whenMatchedUpdate(set={
+            "contagem_clientes": "t.contagem_clientes + s.contagem_clientes",
+            "valor_inadimplencia": "coalesce(t.valor_inadimplencia, 0) + coalesce(s.valor_inadimplencia, 0)",
+        })
+        .whenNotMatchedInsert(condition="s.contagem_clientes > 0", values={
+            **{d: f"s.`{d}`" for d in CUBE_DIMENSIONS},
+            "contagem_clientes": "s.contagem_clientes",
+            "valor_inadimplencia": "s.valor_inadimplencia",
+        })
+        .execute()
+    )
+
+
+def refresh_cube(spark, source_table: str, cube_table: str) -> dict:
+    """Atualiza o cubo até a versão atual de faturamento.
+
+    Aplica só as mudanças desde a última versão processada (MERGE dos
+    grupos alterados). Refaz o cubo inteiro na primeira execução, quando
+    o intervalo tem operações sem CDF completo (ex.: carga com overwrite)
+    ou quando o Change Data Feed não pode ser lido. A versão aplicada é
+    gravada no mesmo commit dos dados (CUBE_VERSION_METADATA).
+    """
+    from ingestion import written_rows
+
+    current = table_version(spark, source_table)
+    applied = cube_source_version(spark, cube_table) if spark.catalog.tableExists(cube_table) else None
+
+    action = "full"
+    if applied is not None and applied >= current:
+        return {"action": "skip", "source_version": current, "rows_changed": 0}
+    if applied is not None and replayable(spark, source_table, applied, current):
+        try:
+            changes_df = (
+                spark.read.option("readChangeFeed", "true")
+                .option("startingVersion", applied + 1)
+                .option("endingVersion", current)
+                .table(source_table)
+            )
+            with commit_metadata(spark, f"{CUBE_VERSION_METADATA}{current}"):
+                merge_cube_changes(spark, cube_table, build_cube_changes(changes_df))
+            action = "merge"
+        except Exception:
+            action = "full"   # CDF desligado ou histórico removido pelo VACUUM
+    if action == "full":
+        # lida na mesma versão registrada no commit (cargas concorrentes ficam para a próxima)
+        source_df = spark.read.option("versionAsOf", current).table(source_table)
+        with commit_metadata(spark, f"{CUBE_VERSION_METADATA}{current}"):
+            build_cube(source_df).write.mode("overwrite").option("overwriteSchema", "true").saveAsTable(cube_table)
+
+    rows_changed = written_rows(spark, cube_table)
+    return {"action": action, "source_version": current, "rows_changed": rows_changed}
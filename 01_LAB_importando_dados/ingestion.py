@@ -0,0 +1,524 @@
+# ----------------------------------------------------------------
+# FUNÇÕES DE INGESTÃO - LAB 01
+# ----------------------------------------------------------------
+# Módulo auxiliar do notebook lab01_carga_csv.py.
+# Lê os arquivos CSV com o leitor distribuído do Spark usando
+# schemas declarados por entidade (sem passar pelo Pandas no driver).
+
+import hashlib
+import itertools
+import os
+import shutil
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from pyspark.sql import functions as F
+from pyspark.sql.types import (
+    DoubleType,
+    IntegerType,
+    LongType,
+    StringType,
+    StructField,
+    StructType,
+)
+
+# ----------------------------------------------------------------
+# SCHEMAS DECLARADOS POR ENTIDADE
+# ----------------------------------------------------------------
+# Colunas de código (cod_cnae, cod_municipio, codigo...) são sempre
+# StringType para preservar os zeros à esquerda ("0111301", "0001").
+
+SCHEMAS = {
+    "faturamento": StructType([
+        StructField("num_cliente",         LongType()),
+        StructField("genero_cliente",      StringType()),
+        StructField("cep_num",             IntegerType()),
+        StructField("cep_formatado",       StringType()),
+        StructField("uf",                  StringType()),
+        StructField("cidade",              StringType()),
+        StructField("bairro",              StringType()),
+        StructField("tipo_logradouro",     StringType()),
+        StructField("logradouro",          StringType()),
+        StructField("latitude",            DoubleType()),
+        StructField("longitude",           DoubleType()),
+        StructField("qde_faturas_total",   IntegerType()),
+        StructField("ind_inadimplente",    StringType()),
+        StructField("qde_faturas_abertas", IntegerType()),
+        StructField("qde_faturas_pagas",   IntegerType()),
+        StructField("qde_pagas_em_atraso", IntegerType()),
+        StructField("val_medio_fatura",    DoubleType()),
+        StructField("val_faturado",        DoubleType()),
+        StructField("val_pago",            DoubleType()),
+        StructField("val_divida",          DoubleType()),
+        StructField("aging_divida",        IntegerType()),
+        StructField("faixa_divida",        StringType()),
+    ]),
+    "cnae": StructType([
+        StructField("cod_cnae",  StringType()),
+        StructField("descricao", StringType()),
+    ]),
+    # empresas_sp.csv não é versionado em dados/: sem schema declarado,
+    # todas as colunas são lidas como string (nenhum código perde zeros).
+    "empresas_sp": None,
+    "ibge_senso": StructType([
+        StructField("COD_MUNICIPIO",  StringType()),
+        StructField("UF",             StringType()),
+        StructField("MUNICIPIO",      StringType()),
+        StructField("MUNNOMEX",       StringType()),
+        StructField("CAPITAL",        StringType()),
+        StructField("ALTITUDE",       IntegerType()),
+        StructField("AREA",           IntegerType()),
+        StructField("LATITUDE",       DoubleType()),
+        StructField("LONGITUDE",      DoubleType()),
+        StructField("QDE_POP_TOTAL",  LongType()),
+        StructField("QDE_POP_URBANA", LongType()),
+        StructField("QDE_POP_RURAL",  LongType()),
+        StructField("QDE_POP_HOMEM",  LongType()),
+        StructField("QDE_POP_MULHER", LongType()),
+    ]),
+    "municipios": StructType([
+        StructField("cod_municipio",  StringType()),
+        StructField("nome_municipio", StringType()),
+    ]),
+    "naturezas": StructType([
+        StructField("codigo",    StringType()),
+        StructField("descricao", StringType()),
+    ]),
+}
+
+INGESTION_MODES = ("spark", "pandas", "pandas_chunked")
+
+# ----------------------------------------------------------------
+# LAYOUT FÍSICO POR ENTIDADE
+# ----------------------------------------------------------------
+# Aplicado depois da gravação (layout.optimize_table): clustering pelas
+# colunas das buscas (bairro e coordenadas em faturamento, código do
+# município no censo...), para o data skipping ler só os arquivos
+# necessários, e estatísticas das colunas usadas em filtros e joins.
+
+LAYOUTS = {
+    "faturamento": {"cluster_by": ["bairro", "latitude", "longitude"],
+                    "statistics": ["bairro", "genero_cliente", "faixa_divida", "ind_inadimplente", "latitude", "longitude"]},
+    "cnae":        {"cluster_by": ["cod_cnae"],      "statistics": ["cod_cnae"]},
+    "empresas_sp": {"cluster_by": [],                "statistics": "all"},
+    "ibge_senso":  {"cluster_by": ["COD_MUNICIPIO"], "statistics": ["COD_MUNICIPIO", "UF"]},
+    "municipios":  {"cluster_by": ["cod_municipio"], "statistics": ["cod_municipio"]},
+    "naturezas":   {"cluster_by": ["codigo"],        "statistics": ["codigo"]},
+}
+
+# ----------------------------------------------------------------
+# MANIFESTO DE INGESTÃO
+# ----------------------------------------------------------------
+# Uma entrada por entidade. "options" vai para o DataFrameWriter e
+# "properties" vira TBLPROPERTIES, definidas na criação da tabela Delta. "natural_key" é a
+# chave usada no MERGE da carga incremental (None = regrava a tabela).
+# faturamento tem Change Data Feed: o cubo de KPIs da gold (gold_h3.refresh_cube)
+# é atualizado só com as linhas alteradas.
+
+ENTITIES = [
+    {"entity": "faturamento", "natural_key": ["num_cliente"],   "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {"delta.enableChangeDataFeed": "true"}},
+    {"entity": "cnae",        "natural_key": ["cod_cnae"],      "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {}},
+    {"entity": "empresas_sp", "natural_key": None,              "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {}},
+    {"entity": "ibge_senso",  "natural_key": ["COD_MUNICIPIO"], "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {}},
+    {"entity": "municipios",  "natural_key": ["cod_municipio"], "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {}},
+    {"entity": "naturezas",   "natural_key": ["codigo"],        "write_mode": "overwrite", "options": {"overwriteSchema": "true"}, "properties": {}},
+]
+
+def build_manifest(catalog_name: str, schema_name: str, source_base: str, entities: list = None) -> list:
+    """Completa as entradas com tabela de destino, caminho de origem, schema e layout."""
+    manifest = []
+    for entry in entities or ENTITIES:
+        entity_name = entry["entity"]
+        manifest.append({
+            **entry,
+            "table": entry.get("table", f"{catalog_name}.{schema_name}.{entity_name}"),
+            "source": entry.get("source", source_path(source_base, entity_name)),
+            "schema": entry.get("schema", SCHEMAS.get(entity_name)),
+            "layout": entry.get("layout", LAYOUTS.get(entity_name)),
+        })
+    return manifest
+
+
+# ----------------------------------------------------------------
+# LOCALIZAÇÃO DOS ARQUIVOS
+# ----------------------------------------------------------------
+
+def is_remote(path: str) -> bool:
+    return path.startswith(("http://", "https://"))
+
+
+def source_path(source_base: str, entity_name: str) -> str:
+    file_name = f"{entity_name}.csv"
+    return f"{source_base}{file_name}" if is_remote(source_base) else os.path.join(source_base, file_name)
+
+
+def stage_source(source: str, landing_dir: str) -> str:
+    """Retorna um caminho legível pelo Spark para o CSV de origem.
+
+    O leitor do Spark não lê URLs HTTP: nesse caso o arquivo é copiado
+    em streaming (sem carregar em memória) para o diretório de landing,
+    normalmente um Volume do Unity Catalog.
+    """
+    if not is_remote(source):
+        return source
+
+    os.makedirs(landing_dir, exist_ok=True)
+    target = os.path.join(landing_dir, os.path.basename(source))
+    with urllib.request.urlopen(source) as response, open(target, "wb") as out:
+        shutil.copyfileobj(response, out, length=8 * 1024 * 1024)
+    return target
+
+
+FINGERPRINT_METHODS = ("stat", "hash")
+
+
+def fingerprint(source: str, method: str = "stat") -> str:
+    """Identifica a versão do arquivo de origem sem lê-lo no Spark.
+
+    "stat" usa tamanho + data de modificação; "hash" calcula o SHA-256 do
+    conteúdo em blocos. Para URLs HTTP usa o ETag (ou tamanho + data)
+    retornado pelo servidor. Retorna None quando não há como identificar,
+    o que força a recarga.
+    """
+    if method not in FINGERPRINT_METHODS:
+        raise ValueError(f"Método de fingerprint inválido: {method}. Use um de {FINGERPRINT_METHODS}.")
+    if is_remote(source):
+        request = urllib.request.Request(source, method="HEAD")
+        with urllib.request.urlopen(request) as response:
+            headers = response.headers
+        etag = headers.get("ETag", "").strip('"')
+        if etag:
+            return f"etag:{etag}"
+        if headers.get("Content-Length") and headers.get("Last-Modified"):
+            return f"stat:{headers['Content-Length']}-{headers['Last-Modified']}"
+        return None
+    if method == "hash":
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        return f"sha256:{digest.hexdigest()}"
+    stat = os.stat(source)
+    return f"stat:{stat.st_size}-{stat.st_mtime_ns}"
+
+
+# ----------------------------------------------------------------
+# LEITURA
+# ----------------------------------------------------------------
+# Os leitores aceitam um dict opcional `timings`, que acumula os
+# segundos gastos em cada etapa ("read", "convert"); usado pelo
+# benchmark de ingestão (benchmark/bench_ingestion.py).
+
+@contextmanager
+def timed_stage(timings: dict, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def read_csv_spark(spark, path: str, schema: StructType = None):
+    """Leitura distribuída com schema declarado (sem inferência)."""
+    reader = (
+        spark.read
+        .option("header", "true")
+        .option("encoding", "UTF-8")
+        .option("mode", "FAILFAST")
+    )
+    if schema is not None:
+        reader = reader.schema(schema)
+    return reader.csv(path)
+
+
+def read_csv_pandas(spark, path: str, schema: StructType = None, timings: dict = None):
+    """Caminho original (Pandas no driver), mantido para comparação."""
+    import pandas as pd
+
+    # colunas string do schema são lidas como str para não perder zeros à esquerda
+    dtype = {f.name: str for f in schema.fields if isinstance(f.dataType, StringType)} if schema else str
+    with timed_stage(timings, "read"):
+        df = pd.read_csv(path, dtype=dtype)              # leitura arquivo CSV utilizando Dataframe Pandas
+    with timed_stage(timings, "convert"):
+        s_df = spark.createDataFrame(df)                 # converte Dataframe Pandas em Spark Dataframe
+        if schema is not None:
+            s_df = s_df.select([F.col(f.name).cast(f.dataType) for f in schema.fields])
+    return s_df
+
+
+# Tipos Pandas (nullable) usados pelo leitor em blocos para chegar ao
+# mesmo resultado do schema Spark, bloco a bloco.
+PANDAS_DTYPES = {
+    StringType: "string",
+    IntegerType: "Int32",
+    LongType: "Int64",
+    DoubleType: "float64",
+}
+
+
+def estimate_chunk_rows(path: str, schema: StructType, memory_budget_mb: int, sample_rows: int = 1000) -> int:
+    """Quantas linhas cabem no orçamento de memória, medindo uma amostra do arquivo.
+
+    Reserva metade do orçamento para a conversão Pandas -> Arrow -> Parquet,
+    que mantém cópias temporárias do bloco.
+    """
+    import pandas as pd
+
+    sample = pd.read_csv(path, nrows=sample_rows, **pandas_read_options(schema))
+    bytes_per_row = max(1, int(sample.memory_usage(deep=True).sum() / max(1, len(sample))))
+    return max(1000, (memory_budget_mb * 1024 * 1024 // 2) // bytes_per_row)
+
+
+def pandas_read_options(schema: StructType = None) -> dict:
+    if schema is None:
+        return {"dtype": "string"}
+    return {
+        "header": 0,
+        "names": [f.name for f in schema.fields],
+        "dtype": {f.name: PANDAS_DTYPES[type(f.dataType)] for f in schema.fields},
+    }
+
+
+def read_csv_pandas_chunked(spark, path: str, staging_dir: str, schema: StructType = None, memory_budget_mb: int = 256,
+                            timings: dict = None):
+    """Lê o CSV em blocos com memória limitada no driver.
+
+    `path` deve ser local (ver stage_source): a memória só fica limitada
+    se o Pandas ler o arquivo em streaming do disco.
+
+    Cada bloco é convertido em Arrow e gravado como um arquivo Parquet no
+    diretório de staging; nenhum bloco fica em memória depois de gravado.
+    O Spark lê o staging inteiro e a tabela Delta recebe um único commit
+    (uma transação lógica), com o mesmo resultado da leitura de uma vez.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    os.makedirs(staging_dir)
+
+    chunk_rows = estimate_chunk_rows(path, schema, memory_budget_mb)
+    chunks = pd.read_csv(path, chunksize=chunk_rows, **pandas_read_options(schema))
+    for i in itertools.count():
+        with timed_stage(timings, "read"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        with timed_stage(timings, "convert"):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            pq.write_table(table, os.path.join(staging_dir, f"part-{i:05d}.parquet"))
+        del chunk, table
+
+    with timed_stage(timings, "convert"):
+        s_df = spark.read.parquet(staging_dir)
+        if schema is not None:
+            s_df = s_df.select([F.col(f.name).cast(f.dataType) for f in schema.fields])
+    return s_df
+
+
+def chunk_staging_dir(landing_dir: str, entity: str) -> str:
+    return os.path.join(landing_dir, "_chunks", entity)
+
+
+def read_entity(spark, entry: dict, landing_dir: str, mode: str = "spark", memory_budget_mb: int = 256,
+                timings: dict = None):
+    if mode not in INGESTION_MODES:
+        raise ValueError(f"Modo de ingestão inválido: {mode}. Use um de {INGESTION_MODES}.")
+    if mode == "pandas":
+        # o Pandas lê a URL diretamente, como no notebook original
+        return read_csv_pandas(spark, entry["source"], entry["schema"], timings)
+    if mode == "pandas_chunked":
+        # URLs são copiadas antes para o landing: o Pandas bufferiza a resposta HTTP
+        # inteira em memória, e a amostra + os blocos baixariam o arquivo duas vezes
+        with timed_stage(timings, "read"):
+            path = stage_source(entry["source"], landing_dir)
+        staging_dir = chunk_staging_dir(landing_dir, entry["entity"])
+        return read_csv_pandas_chunked(spark, path, staging_dir, entry["schema"], memory_budget_mb, timings)
+    # leitura lazy: o CSV só é lido (e convertido) dentro do job de gravação
+    with timed_stage(timings, "read"):
+        return read_csv_spark(spark, stage_source(entry["source"], landing_dir), entry["schema"])
+
+
+# ----------------------------------------------------------------
+# GRAVAÇÃO
+# ----------------------------------------------------------------
+
+def set_missing_properties(spark, table_name: str, properties: dict):
+    """Aplica só as TBLPROPERTIES ausentes ou diferentes: cada ALTER TABLE
+    é uma nova versão Delta (e o último commit deixa de ser a gravação)."""
+    if not properties:
+        return
+    current = {row["key"]: row["value"] for row in spark.sql(f"SHOW TBLPROPERTIES {table_name}").collect()}
+    missing = {k: v for k, v in properties.items() if current.get(k) != str(v)}
+    if missing:
+        props = ", ".join(f"'{k}' = '{v}'" for k, v in missing.items())
+        spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES ({props})")
+
+
+def write_entity(spark, s_df, entry: dict):
+    properties = entry.get("properties", {})
+    if properties and not spark.catalog.tableExists(entry["table"]):
+        # tabela nova: as propriedades entram no próprio CREATE, sem commit extra
+        writer = s_df.writeTo(entry["table"]).using("delta")
+        for key, value in properties.items():
+            writer = writer.tableProperty(key, value)
+        writer.create()
+        return
+
+    writer = s_df.write.mode(entry.get("write_mode", "overwrite"))
+    for key, value in entry.get("options", {}).items():
+        writer = writer.option(key, value)
+    writer.saveAsTable(entry["table"])                   # grava o DataFrame na Tabela Delta
+
+    # o overwrite preserva as propriedades: o ALTER só roda em tabelas antigas, sem elas
+    set_missing_properties(spark, entry["table"], properties)
+
+
+def merge_entity(spark, s_df, entry: dict):
+    """Upsert pela chave natural: insere novas, atualiza só as linhas que
+    mudaram e remove as que saíram do arquivo (o CSV é um snapshot completo)."""
+    from delta.tables import DeltaTable
+
+    keys = entry["natural_key"]
+    s_df = s_df.dropDuplicates(keys)
+    on = " AND ".join(f"t.`{k}` = s.`{k}`" for k in keys)
+    changed = " OR ".join(f"NOT (t.`{c}` <=> s.`{c}`)" for c in s_df.columns if c not in keys)
+
+    merge = DeltaTable.forName(spark, entry["table"]).alias("t").merge(s_df.alias("s"), on)
+    if changed:
+        merge = merge.whenMatchedUpdateAll(condition=changed)
+    merge.whenNotMatchedInsertAll().whenNotMatchedBySourceDelete().execute()
+
+
+def written_rows(spark, table_name: str) -> int:
+    """Linhas afetadas pelo último commit, lidas do histórico Delta (sem varrer a tabela)."""
+    last = spark.sql(f"DESCRIBE HISTORY {table_name} LIMIT 1").collect()
+    metrics = last[0]["operationMetrics"] if last else None
+    # MERGE também reporta numOutputRows (inclui as linhas inalteradas regravadas): conta só as afetadas
+    if metrics and "numTargetRowsInserted" in metrics:
+        return sum(int(metrics.get(m, 0)) for m in ("numTargetRowsInserted", "numTargetRowsUpdated", "numTargetRowsDeleted"))
+    if metrics and "numOutputRows" in metrics:
+        return int(metrics["numOutputRows"])
+    return spark.table(table_name).count()
+
+
+def schema_matches(spark, table_name: str, schema: StructType) -> bool:
+    """True se a tabela já tem as colunas e tipos declarados (nulabilidade à parte)."""
+    if schema is None:
+        return True
+    current = [(f.name.lower(), f.dataType) for f in spark.table(table_name).schema.fields]
+    return current == [(f.name.lower(), f.dataType) for f in schema.fields]
+
+
+def load_entity(spark, entry: dict, landing_dir: str, mode: str = "spark", incremental: bool = False,
+                previous_fingerprint: str = None, fingerprint_method: str = "stat",
+                memory_budget_mb: int = 256, timings: dict = None) -> dict:
+    start = time.perf_counter()
+    result = {"entity": entry["entity"], "table": entry["table"], "fingerprint": None}
+    exists = spark.catalog.tableExists(entry["table"])
+
+    if incremental:
+        result["fingerprint"] = fingerprint(entry["source"], fingerprint_method)
+        if exists and result["fingerprint"] is not None and result["fingerprint"] == previous_fingerprint:
+            # arquivo inalterado: nenhuma nova versão Delta é criada
+            return {**result, "action": "skip", "rows": 0, "seconds": round(time.perf_counter() - start, 2)}
+
+    # MERGE só depois de uma carga registrada e com o schema declarado: tabelas antigas
+    # (ex.: criadas pelo notebook original, com códigos como BIGINT) são regravadas
+    mergeable = (
+        incremental and exists and entry.get("natural_key") and previous_fingerprint is not None
+        and schema_matches(spark, entry["table"], entry.get("schema"))
+    )
+    try:
+        s_df = read_entity(spark, entry, landing_dir, mode, memory_budget_mb, timings)
+        with timed_stage(timings, "write"):
+            if mergeable:
+                # tabelas anteriores às propriedades (ex.: faturamento sem CDF) as recebem uma vez
+                set_missing_properties(spark, entry["table"], entry.get("properties", {}))
+                merge_entity(spark, s_df, entry)
+                action = "merge"
+            else:
+                write_entity(spark, s_df, entry)
+                action = entry.get("write_mode", "overwrite")
+    finally:
+        # o Parquet de staging (modo pandas_chunked) só é lido pelo job de gravação
+        if mode == "pandas_chunked":
+            shutil.rmtree(chunk_staging_dir(landing_dir, entry["entity"]), ignore_errors=True)
+
+    return {
+        **result,
+        "action": action,
+        "rows": written_rows(spark, entry["table"]),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+# ----------------------------------------------------------------
+# ESTADO DA CARGA INCREMENTAL
+# ----------------------------------------------------------------
+# Tabela pequena com o fingerprint da última carga de cada entidade.
+# É gravada uma única vez por execução (evita commits concorrentes).
+
+def read_state(spark, state_table: str) -> dict:
+    spark.sql(
+        f"CREATE TABLE IF NOT EXISTS {state_table} "
+        f"(entity STRING, fingerprint STRING, loaded_at TIMESTAMP)"
+    )
+    return {row["entity"]: row["fingerprint"] for row in spark.table(state_table).collect()}
+
+
+def save_state(spark, state_table: str, results: list):
+    rows = [(r["entity"], r["fingerprint"]) for r in results
+            if r["status"] == "ok" and r["action"] != "skip" and r["fingerprint"] is not None]
+    if not rows:
+        return
+    updates = spark.createDataFrame(rows, "entity string, fingerprint string")
+    updates.createOrReplaceTempView("_ingestion_state_updates")
+    spark.sql(f"""
+        MERGE INTO {state_table} t
+        USING _ingestion_state_updates s
+        ON t.entity = s.entity
+        WHEN MATCHED THEN UPDATE SET t.fingerprint = s.fingerprint, t.loaded_at = current_timestamp()
+        WHEN NOT MATCHED THEN INSERT (entity, fingerprint, loaded_at) VALUES (s.entity, s.fingerprint, current_timestamp())
+    """)
+
+
+def load_all(spark, manifest: list, landing_dir: str, mode: str = "spark", max_workers: int = 4,
+             incremental: bool = False, state_table: str = None, fingerprint_method: str = "stat",
+             memory_budget_mb: int = 256) -> list:
+    """Carrega as entidades do manifesto em paralelo na mesma SparkSession.
+
+    Cada thread dispara seus próprios jobs Spark; o pool limitado evita
+    saturar o cluster. Falhas são reportadas por entidade, sem
+    interromper as demais cargas. Com incremental=True, entidades cujo
+    arquivo não mudou desde a última carga são puladas e as demais
+    recebem MERGE pela chave natural (a primeira carga registrada, ou com
+    schema diferente do declarado, regrava a tabela).
+    """
+    if incremental and not state_table:
+        raise ValueError("A carga incremental precisa de state_table.")
+    previous = read_state(spark, state_table) if incremental else {}
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(load_entity, spark, entry, landing_dir, mode, incremental,
+                            previous.get(entry["entity"]), fingerprint_method, memory_budget_mb): entry
+            for entry in manifest
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                results.append({**future.result(), "status": "ok", "error": None})
+            except Exception as e:
+                results.append({"entity": entry["entity"], "table": entry["table"], "fingerprint": None,
+                                "action": None, "rows": None, "seconds": None, "status": "erro", "error": str(e)})
+
+    if incremental:
+        save_state(spark, state_table, results)
+    return sorted(results, key=lambda r: r["entity"])
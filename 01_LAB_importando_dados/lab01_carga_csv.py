@@ -38,14 +38,39 @@
 # COMMAND ----------
 
 
-import pandas as pd
 from pyspark.sql import SparkSession
 
+from ingestion import build_manifest, load_all
+from layout import LAYOUT_REPORT_SCHEMA, optimize_all
+
 url = f"https://raw.githubusercontent.com//Databricks-BR/lab_agosto_2025/main/dados/"
+# url = f"../dados/"     # alternativa: diretório local com os CSV (ex.: repositório clonado no Workspace)
 
 
 catalog_name = f"workshop_08_2025"
 
+# "spark"          : leitura distribuída com schema declarado (recomendado)
+# "pandas"         : caminho original - pd.read_csv no driver + spark.createDataFrame
+# "pandas_chunked" : Pandas em blocos, com memória do driver limitada (clusters pequenos)
+ingestion_mode = f"spark"
+
+# Orçamento de memória do driver (MB) por arquivo no modo "pandas_chunked"
+memory_budget_mb = 256
+
+# Volume de landing onde os CSV remotos são copiados para o Spark ler
+volume_name = f"landing"
+
+# True  : pula entidades cujo CSV não mudou e faz MERGE pela chave natural nas demais
+# False : regrava todas as tabelas (overwrite)
+incremental = True
+
+# "stat" : tamanho + data de modificação (ou ETag, para URLs)  |  "hash" : SHA-256 do conteúdo
+fingerprint_method = f"stat"
+
+# True : depois da carga, aplica o layout físico de cada tabela gravada
+#        (clustering, compactação e estatísticas - ver ingestion.LAYOUTS)
+optimize_layout = True
+
 
 # COMMAND ----------
 
@@ -65,81 +90,51 @@ create_schema = f"CREATE SCHEMA IF NOT EXISTS {catalog_name}.{schema_name}"
 spark.sql (create_schema)
 
 
+create_volume = f"CREATE VOLUME IF NOT EXISTS {catalog_name}.{schema_name}.{volume_name}"
+spark.sql (create_volume)
 
-# COMMAND ----------
-
-# DBTITLE 1,Gravando a tabela DELTA - FATURAMENTO
+landing_dir = f"/Volumes/{catalog_name}/{schema_name}/{volume_name}/csv"
 
-entity_name  = f"faturamento"
+state_table = f"{catalog_name}.{schema_name}._ingestion_state"   # fingerprint da última carga de cada entidade
 
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
 
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
 
 # COMMAND ----------
 
-# DBTITLE 1,Gravando a tabela DELTA - CNAE
+# DBTITLE 1,Manifesto de ingestão
+# Uma entrada por entidade: tabela de destino, arquivo de origem, schema,
+# modo de gravação e opções da tabela. Edite aqui para incluir/remover entidades.
 
-entity_name  = f"cnae"
+manifest = build_manifest(catalog_name, schema_name, url)
 
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
-
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
+for entry in manifest:
+    print(f"{entry['entity']:<12} {entry['write_mode']:<10} {entry['source']} -> {entry['table']}")
 
 # COMMAND ----------
 
-# DBTITLE 1,Gravando a tabela DELTA - empresas
+# DBTITLE 1,Gravando as tabelas DELTA (carga paralela)
 
-entity_name  = f"empresas_sp"
+max_workers = 4     # quantidade de tabelas carregadas ao mesmo tempo
 
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
+results = load_all(spark, manifest, landing_dir, ingestion_mode, max_workers,
+                   incremental, state_table, fingerprint_method,
+                   memory_budget_mb)  # lê os CSV e grava nas Tabelas Delta
 
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
+display(spark.createDataFrame(
+    results,
+    "entity string, table string, fingerprint string, action string, rows long, seconds double, status string, error string",
+))
 
 # COMMAND ----------
 
-# DBTITLE 1,Gravando a tabela DELTA - SENSO IBGE 2010
-
-entity_name  = f"ibge_senso"
-
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
-
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
-
-# COMMAND ----------
-
-# DBTITLE 1,Gravando a tabela DELTA - municipios
-
-entity_name  = f"municipios"
-
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
-
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
-
-# COMMAND ----------
-
-# DBTITLE 1,Gravando a tabela DELTA - naturezas
-
-entity_name  = f"naturezas"
+# DBTITLE 1,Otimização do layout físico (clustering, compactação e estatísticas)
+# Só as tabelas gravadas nesta execução. O relatório mostra arquivos e bytes
+# antes e depois: poucos arquivos grandes e clusterizados pelas colunas das
+# buscas permitem ao data skipping ignorar os arquivos fora do filtro.
 
-table_name   = f"{catalog_name}.{schema_name}.{entity_name}"
-file_name = f"{url}{entity_name}.csv"
+loaded = {r["entity"] for r in results if r["status"] == "ok" and r["action"] != "skip"}
+targets = [(entry["table"], entry["layout"]) for entry in manifest if entry["entity"] in loaded]
 
-df = pd.read_csv(file_name)                          # leitura arquivo CSV utilizando Dataframe Pandas
-s_df = spark.createDataFrame(df)                     # converte Dataframe Pandas em Spark Dataframe
-s_df.write.mode("overwrite").saveAsTable(table_name) # grava o DataFrame na Tabela Delta
+if optimize_layout and targets:
+    layout_results = optimize_all(spark, targets)
+    display(spark.createDataFrame(layout_results, LAYOUT_REPORT_SCHEMA))
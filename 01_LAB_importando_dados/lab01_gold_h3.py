@@ -0,0 +1,117 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC <img src="https://raw.githubusercontent.com/Databricks-BR/lab_agosto_2025/main/images/head_lab.png">
+# MAGIC
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Descrição
+# MAGIC
+# MAGIC | projeto | aplicação | módulo | tabela | objetivo |
+# MAGIC | --- | --- | --- | --- | --- |
+# MAGIC | ACADEMY | Laboratório 1 | ETL Gold | gold_faturamento_h3 | Inadimplência agregada por hexágono H3 para o Lakehouse App (LAB 04) |
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Referências
+# MAGIC * [Funções geoespaciais H3](https://docs.databricks.com/pt/sql/language-manual/sql-ref-h3-geospatial-functions.html)
+# MAGIC * [Pandas UDFs](https://docs.databricks.com/pt/udf/pandas.html)
+# MAGIC
+
+# COMMAND ----------
+
+# MAGIC %pip install h3 -q
+# MAGIC dbutils.library.restartPython()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Parâmetros Iniciais
+
+# COMMAND ----------
+
+from pyspark.sql import functions as F
+
+from gold_h3 import (CUBE_LAYOUT, GOLD_LAYOUT, H3_RESOLUTIONS, ROLLUP_LAYOUT, build_gold_h3, build_rollup,
+                     refresh_cube, write_gold)
+from layout import LAYOUT_REPORT_SCHEMA, optimize_all, optimize_table
+
+catalog_name = f"workshop_08_2025"
+
+# Resoluções H3 calculadas (a mais fina define o grão da tabela gold)
+h3_resolutions = H3_RESOLUTIONS
+
+
+# COMMAND ----------
+
+# DBTITLE 1,ALTERE ESSE PARAMETRO
+#schema_name  = f"<<<<<-----COLOQUE SEU USER NAME AQUI --------->>>>"
+
+schema_name  = f"inadimplencia"
+
+
+# COMMAND ----------
+
+source_table = f"{catalog_name}.{schema_name}.faturamento"
+gold_table   = f"{catalog_name}.{schema_name}.gold_faturamento_h3"
+rollup_table = f"{catalog_name}.{schema_name}.gold_faturamento_h3_rollup"
+cube_table   = f"{catalog_name}.{schema_name}.gold_faturamento_cubo"
+
+# COMMAND ----------
+
+# DBTITLE 1,Gravando a tabela DELTA - GOLD H3
+# Células H3 como BIGINT (64 bits): a mais fina via pandas UDF em lotes Arrow,
+# os pais derivados dela com operações de bits nativas do Spark.
+# A tabela é criada com Change Data Feed na primeira execução; nas seguintes
+# recebe MERGE só dos grupos alterados e o App atualiza seus caches com eles.
+
+gold_df = build_gold_h3(spark.table(source_table), h3_resolutions)
+gold_result = write_gold(spark, gold_df, gold_table)
+print(gold_result)
+
+display(spark.table(gold_table).limit(10))
+
+# COMMAND ----------
+
+# DBTITLE 1,Índice espacial - clusterização por H3
+# Os descendentes de uma célula H3 têm ids contíguos: o App filtra a área
+# visível com faixas "h3_09_id BETWEEN ..." e, com a tabela clusterizada
+# por h3_09_id, lê apenas os arquivos daquela região (data skipping).
+
+gold_layout = optimize_table(spark, gold_table, GOLD_LAYOUT)   # CLUSTER BY (h3_09_id) + OPTIMIZE + estatísticas
+print(gold_layout)
+
+# COMMAND ----------
+
+# DBTITLE 1,Gravando a tabela DELTA - GOLD H3 por resolução
+# Um registro por (resolução, célula, gênero, bairro, faixa de dívida):
+# o App lê direto a resolução desejada, sem agregar nem converter nada.
+
+rollup_df = build_rollup(spark.table(gold_table), h3_resolutions)
+rollup_df.write.mode("overwrite").option("overwriteSchema", "true").saveAsTable(rollup_table)
+
+display(spark.table(rollup_table).groupBy("h3_resolucao").agg(F.count("*").alias("linhas"), F.sum("contagem_clientes").alias("clientes")))
+
+# COMMAND ----------
+
+# DBTITLE 1,Cubo de agregados - KPIs e filtros do App
+# Totais por uf, cidade, gênero, bairro e faixa de dívida (poucos milhares de linhas).
+# Na primeira execução o cubo é criado; nas seguintes recebe só as mudanças de
+# faturamento desde a última atualização (Change Data Feed + MERGE).
+
+cube_result = refresh_cube(spark, source_table, cube_table)
+print(cube_result)
+
+display(spark.table(cube_table).groupBy("uf", "cidade").agg(F.sum("contagem_clientes").alias("clientes"), F.sum("valor_inadimplencia").alias("valor")))
+
+# COMMAND ----------
+
+# DBTITLE 1,Layout físico - rollup e cubo
+# Arquivos e bytes antes/depois da compactação; o rollup é clusterizado por
+# resolução + célula, o cubo (pequeno) só compactado, com estatísticas.
+
+layout_results = optimize_all(spark, [(rollup_table, ROLLUP_LAYOUT), (cube_table, CUBE_LAYOUT)])
+
+display(spark.createDataFrame(layout_results, LAYOUT_REPORT_SCHEMA))
@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------
+# OTIMIZAÇÃO DO LAYOUT FÍSICO - LAB 01
+# ----------------------------------------------------------------
+# Módulo auxiliar dos notebooks lab01_carga_csv.py e lab01_gold_h3.py.
+# Etapa executada depois da gravação das tabelas Delta, configurada por
+# tabela: chaves de liquid clustering (colunas usadas nas buscas do App),
+# compactação dos arquivos pequenos (OPTIMIZE) e estatísticas de colunas
+# (ANALYZE). Reporta arquivos e bytes antes e depois de cada tabela.
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Layout de uma tabela:
+#   "cluster_by" : chaves de clustering (até 4); [] = só compactação
+#   "optimize"   : executa OPTIMIZE (compacta e clusteriza os arquivos novos)
+#   "statistics" : colunas com estatísticas para o otimizador; "all" = todas, [] = nenhuma
+DEFAULT_LAYOUT = {"cluster_by": [], "optimize": True, "statistics": []}
+
+LAYOUT_REPORT_SCHEMA = (
+    "table string, cluster_by string, action string, files_before long, files_after long, "
+    "bytes_before long, bytes_after long, seconds double, status string, error string"
+)
+
+
+def table_detail(spark, table_name: str) -> dict:
+    """Arquivos, bytes e chaves de clustering atuais (metadados Delta, sem ler dados)."""
+    detail = spark.sql(f"DESCRIBE DETAIL {table_name}").collect()[0].asDict()
+    return {
+        "files": int(detail.get("numFiles") or 0),
+        "bytes": int(detail.get("sizeInBytes") or 0),
+        "cluster_by": list(detail.get("clusteringColumns") or []),
+    }
+
+
+def statistics_sql(table_name: str, statistics) -> str:
+    if statistics == "all":
+        return f"ANALYZE TABLE {table_name} COMPUTE STATISTICS FOR ALL COLUMNS"
+    columns = ", ".join(f"`{c}`" for c in statistics)
+    return f"ANALYZE TABLE {table_name} COMPUTE STATISTICS FOR COLUMNS {columns}"
+
+
+def optimize_table(spark, table_name: str, layout: dict = None) -> dict:
+    """Aplica o layout a uma tabela Delta e mede o efeito.
+
+    Chaves de clustering diferentes das atuais são trocadas com ALTER
+    TABLE ... CLUSTER BY e, nesse caso, o OPTIMIZE reescreve a tabela
+    inteira (FULL) para que os arquivos antigos também sigam as novas
+    chaves; caso contrário o OPTIMIZE só compacta/clusteriza o que ainda
+    não foi otimizado. As estatísticas de colunas vêm por último.
+    """
+    layout = {**DEFAULT_LAYOUT, **(layout or {})}
+    start = time.perf_counter()
+    before = table_detail(spark, table_name)
+
+    actions = []
+    current_keys = [c.lower() for c in before["cluster_by"]]
+    recluster = bool(layout["cluster_by"]) and current_keys != [c.lower() for c in layout["cluster_by"]]
+    if recluster:
+        spark.sql(f"ALTER TABLE {table_name} CLUSTER BY ({', '.join(layout['cluster_by'])})")
+        actions.append("cluster_by")
+    if layout["optimize"]:
+        spark.sql(f"OPTIMIZE {table_name}{' FULL' if recluster else ''}")
+        actions.append("optimize_full" if recluster else "optimize")
+    if layout["statistics"]:
+        spark.sql(statistics_sql(table_name, layout["statistics"]))
+        actions.append("statistics")
+
+    after = table_detail(spark, table_name)
+    return {
+        "table": table_name,
+        "cluster_by": ", ".join(after["cluster_by"]),
+        "action": "+".join(actions) or "none",
+        "files_before": before["files"],
+        "files_after": after["files"],
+        "bytes_before": before["bytes"],
+        "bytes_after": after["bytes"],
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def optimize_all(spark, targets: list, max_workers: int = 2) -> list:
+    """Otimiza (table_name, layout) em paralelo; falhas são reportadas por
+    tabela, sem interromper as demais (como em ingestion.load_all)."""
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(optimize_table, spark, table_name, layout): table_name
+                   for table_name, layout in targets}
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                results.append({**future.result(), "status": "ok", "error": None})
+            except Exception as e:
+                results.append({"table": table_name, "cluster_by": None, "action": None,
+                                "files_before": None, "files_after": None, "bytes_before": None,
+                                "bytes_after": None, "seconds": None, "status": "erro", "error": str(e)})
+    return sorted(results, key=lambda r: r["table"])
@@ -0,0 +1,459 @@
+# ----------------------------------------------------------------
+# OFFLINE LOAD TEST / BENCHMARK FOR THE LAKEHOUSE APP
+# ----------------------------------------------------------------
+# Runs lakehouse_app/app.py with Streamlit's AppTest, without a
+# workspace:
+#   * the SQL warehouse is DuckDB, serving a synthetic
+#     gold_faturamento_h3 generated from dados/faturamento.csv (real
+#     bairros, genders, debt bands and H3 cells, scaled to N rows) and
+#     its KPI cube;
+#   * the Databricks SDK is a fake Genie with configurable latency whose
+#     answers run their SQL on the same DuckDB.
+# N concurrent sessions go through map loads, zoom and filter changes
+# and chat questions; the report has p50/p95/p99 per step, process
+# memory and warehouse/Genie calls.
+#
+#   python bench_app.py --rows 10000,1000000 --sessions 8 --output report.json
+#
+# Requires: streamlit, duckdb, pyarrow, h3, psutil (+ pydeck/keplergl to
+# render the maps; without them those steps time the error path).
+
+"""Offline load test of the Lakehouse App: concurrent AppTest sessions
+against a DuckDB warehouse and a fake Genie, reporting p50/p95/p99 per
+step, process memory and warehouse/Genie calls for each gold table size.
+Example: python bench_app.py --rows 10000,1000000 --sessions 8 --output report.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, "..", "lakehouse_app")
+DEFAULT_SOURCE = os.path.join(HERE, "..", "..", "dados", "faturamento.csv")
+
+GOLD_TABLE = "academy.genie_aibi.gold_faturamento_h3"
+CUBE_TABLE = "academy.genie_aibi.gold_faturamento_cubo"
+
+QUESTIONS = (
+    "Qual bairro tem mais inadimplentes?",
+    "Qual o valor total de inadimplência por faixa de dívida?",
+    "Quantos clientes inadimplentes por gênero?",
+    "Qual região tem mais inadimplentes?",
+)
+GENIE_SQL = {
+    # question (normalized by the fake) -> SQL the fake Genie "generates"
+    "bairro": f"SELECT bairro, SUM(contagem_clientes) AS clientes FROM {GOLD_TABLE} GROUP BY bairro ORDER BY clientes DESC LIMIT 20",
+    "faixa": f"SELECT faixa_divida, SUM(valor_inadimplencia) AS valor FROM {GOLD_TABLE} GROUP BY faixa_divida ORDER BY faixa_divida",
+    "genero": f"SELECT genero_cliente, SUM(contagem_clientes) AS clientes FROM {GOLD_TABLE} GROUP BY genero_cliente",
+}
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+# ----------------------------------------------------------------
+# SYNTHETIC GOLD TABLE
+# ----------------------------------------------------------------
+
+def build_gold(rows: int, source_csv: str, seed: int = 42):
+    """Arrow table with the gold_faturamento_h3 columns and `rows` rows.
+
+    Cells come from the real customer coordinates (res 9) plus two rings
+    around them; dimension combinations are sampled from the real
+    delinquent customers, so cardinalities match the lab data.
+    """
+    import h3
+    import pyarrow as pa
+
+    rng = np.random.default_rng(seed)
+    source = pd.read_csv(source_csv, usecols=["genero_cliente", "bairro", "faixa_divida", "latitude",
+                                              "longitude", "ind_inadimplente", "val_divida"])
+    source = source[source["ind_inadimplente"] == "S"].dropna(subset=["latitude", "longitude"])
+
+    cells = set()
+    for lat, lng in zip(source["latitude"], source["longitude"]):
+        cells.update(h3.grid_disk(h3.latlng_to_cell(lat, lng, 9), 2))
+    cells = np.array(sorted(h3.str_to_int(c) for c in cells), dtype=np.int64)
+
+    combos = source[["genero_cliente", "bairro", "faixa_divida"]].astype(str).reset_index(drop=True)
+    pick = rng.integers(0, len(combos), rows)
+    columns = {"h3_09_id": pa.array(cells[rng.integers(0, len(cells), rows)])}
+    for column in combos.columns:
+        codes, uniques = pd.factorize(combos[column])
+        columns[column] = pa.DictionaryArray.from_arrays(pa.array(codes[pick].astype(np.int32)), pa.array(uniques))
+    counts = rng.integers(1, 6, rows)
+    debt = source["val_divida"].to_numpy(dtype="float64")
+    columns["contagem_clientes"] = pa.array(counts.astype(np.int64))
+    columns["valor_inadimplencia"] = pa.array(np.round(debt[rng.integers(0, len(debt), rows)] * counts, 2))
+    return pa.table(columns)
+
+
+# ----------------------------------------------------------------
+# WAREHOUSE STAND-IN (DuckDB)
+# ----------------------------------------------------------------
+
+class DuckDBWarehouse:
+    """Same interface as warehouse.ConnectionPool, answered by DuckDB."""
+
+    def __init__(self, gold, latency_ms: float = 0.0):
+        import duckdb
+
+        self.latency = latency_ms / 1000
+        self.version = 1
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._db = duckdb.connect()
+        self._db.execute("ATTACH ':memory:' AS academy")
+        self._db.execute("CREATE SCHEMA academy.genie_aibi")
+        self._db.register("gold_source", gold)
+        self._db.execute(f"CREATE TABLE {GOLD_TABLE} AS SELECT * FROM gold_source")
+        self._db.unregister("gold_source")
+        # KPI cube of lab01_gold_h3 (the lab data is all in São Paulo)
+        self._db.execute(f"""
+            CREATE TABLE {CUBE_TABLE} AS
+            SELECT 'SP' AS uf, 'SAO PAULO' AS cidade, genero_cliente, bairro, faixa_divida,
+                   SUM(contagem_clientes)::BIGINT AS contagem_clientes, SUM(valor_inadimplencia) AS valor_inadimplencia
+            FROM {GOLD_TABLE} GROUP BY ALL
+        """)
+        # Databricks H3 function used by the coarser map resolutions (same bit layout as geo.py)
+        self._db.execute("""
+            CREATE MACRO h3_toparent(cell, res) AS
+            (cell & ~(15::BIGINT << 52)) | (res::BIGINT << 52) | ((1::BIGINT << (3 * (15 - res))) - 1)
+        """)
+
+    def _count(self, query: str) -> str:
+        kind = query.split(None, 1)[0].upper()
+        kind = "CHANGES" if "table_changes(" in query else kind
+        with self._lock:
+            self.calls[kind] += 1
+        return kind
+
+    def query_arrow(self, query: str, parameters: dict = None, timeout: int = None):
+        import pyarrow as pa
+
+        kind = self._count(query)
+        if self.latency:
+            time.sleep(self.latency)
+        if kind == "DESCRIBE":
+            return pa.table({"version": [self.version]})
+        if kind == "CHANGES":
+            raise RuntimeError("change data feed not available in the stand-in")
+        # Databricks :name parameters -> DuckDB $name
+        sql = re.sub(r"(?<![:\w]):(\w+)", r"$\1", query)
+        table = self._db.cursor().execute(sql, parameters or {}).fetch_arrow_table()
+        # SUM(BIGINT) is HUGEINT (decimal(38,0)) in DuckDB, BIGINT on Databricks
+        for i, field in enumerate(table.schema):
+            if pa.types.is_decimal(field.type):
+                target = pa.int64() if field.type.scale == 0 else pa.float64()
+                table = table.set_column(i, field.name, table.column(i).cast(target))
+            elif pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        return table
+
+    def query(self, query: str, parameters: dict = None, timeout: int = None) -> pd.DataFrame:
+        return self.query_arrow(query, parameters, timeout).to_pandas()
+
+    def bump_version(self):
+        # simulates a write to the gold table (the app refetches on its next version check)
+        self.version += 1
+
+
+# ----------------------------------------------------------------
+# GENIE / SDK STAND-IN
+# ----------------------------------------------------------------
+
+class FakeGenie:
+    """The GenieAPI + statement_execution calls used by genie.GenieClient.
+
+    A message walks through the real status sequence over `latency`
+    seconds; its SQL runs on the DuckDB warehouse and comes back as
+    JSON_ARRAY chunks of `chunk_rows` rows, like the Statement API.
+    """
+
+    STEPS = ("FETCHING_METADATA", "FILTERING_CONTEXT", "ASKING_AI", "EXECUTING_QUERY")
+
+    def __init__(self, warehouse: DuckDBWarehouse, latency: float = 2.0, chunk_rows: int = 1000):
+        self.warehouse = warehouse
+        self.latency = latency
+        self.chunk_rows = chunk_rows
+        self.calls = defaultdict(int)
+        self._messages = {}
+        self._statements = {}
+        self._lock = threading.Lock()
+        self.statement_execution = types.SimpleNamespace(
+            get_statement=self.get_statement,
+            get_statement_result_chunk_n=self.get_statement_result_chunk_n,
+            cancel_execution=lambda statement_id: None,
+        )
+
+    def _new_message(self, space_id, conversation_id, content):
+        text = content.lower()
+        key = next((k for k in GENIE_SQL if k in text), None)
+        with self._lock:
+            self.calls["messages"] += 1
+            message_id = f"m{len(self._messages)}"
+            self._messages[message_id] = (time.monotonic(), conversation_id, GENIE_SQL.get(key), content)
+        return types.SimpleNamespace(conversation_id=conversation_id, message_id=message_id)
+
+    # --- GenieAPI ---
+
+    def start_conversation(self, space_id, content):
+        return self._new_message(space_id, f"c{random.getrandbits(32)}", content)
+
+    def create_message(self, space_id, conversation_id, content):
+        return self._new_message(space_id, conversation_id, content)
+
+    def get_message(self, space_id, conversation_id, message_id):
+        self.calls["polls"] += 1
+        started, conversation_id, sql, content = self._messages[message_id]
+        progress = (time.monotonic() - started) / self.latency if self.latency else 1
+        status = "COMPLETED" if progress >= 1 else self.STEPS[int(progress * len(self.STEPS))]
+        if sql:
+            attachment = types.SimpleNamespace(text=None, query=types.SimpleNamespace(
+                query=sql, description="Consulta gerada pelo Genie (benchmark)", statement_id=None))
+        else:
+            attachment = types.SimpleNamespace(text=types.SimpleNamespace(content=f"Resposta para: {content}"), query=None)
+        return types.SimpleNamespace(
+            status=types.SimpleNamespace(value=status), error=None, id=message_id,
+            conversation_id=conversation_id, attachments=[attachment] if status == "COMPLETED" else [],
+        )
+
+    def get_message_query_result(self, space_id, conversation_id, message_id):
+        _, _, sql, _ = self._messages[message_id]
+        rows = self.warehouse.query(sql)
+        statement_id = f"s{message_id}"
+        with self._lock:
+            self._statements[statement_id] = rows
+        return types.SimpleNamespace(statement_response=types.SimpleNamespace(statement_id=statement_id))
+
+    # --- statement execution ---
+
+    def _chunk(self, statement_id, index):
+        rows = self._statements[statement_id]
+        part = rows.iloc[index * self.chunk_rows:(index + 1) * self.chunk_rows]
+        data = [[None if pd.isna(v) else str(v) for v in row] for row in part.itertuples(index=False)]
+        return types.SimpleNamespace(chunk_index=index, data_array=data, external_links=None)
+
+    def get_statement(self, statement_id):
+        self.calls["statements"] += 1
+        rows = self._statements[statement_id]
+        type_names = {"i": "LONG", "u": "LONG", "f": "DOUBLE", "b": "BOOLEAN"}
+        columns = [types.SimpleNamespace(name=c, type_name=types.SimpleNamespace(value=type_names.get(rows[c].dtype.kind, "STRING")),
+                                         type_precision=None, type_scale=None) for c in rows.columns]
+        chunks = [types.SimpleNamespace(chunk_index=i, row_offset=i * self.chunk_rows)
+                  for i in range(max(1, -(-len(rows) // self.chunk_rows)))]
+        manifest = types.SimpleNamespace(schema=types.SimpleNamespace(columns=columns), chunks=chunks)
+        return types.SimpleNamespace(manifest=manifest, result=self._chunk(statement_id, 0))
+
+    def get_statement_result_chunk_n(self, statement_id, chunk_index):
+        self.calls["chunks"] += 1
+        return self._chunk(statement_id, chunk_index)
+
+
+def install_stand_ins(state: dict):
+    """Replaces the `warehouse` module and the Databricks SDK entry points
+    imported by the app with the stand-ins in `state` (swapped per scale)."""
+    warehouse = types.ModuleType("warehouse")
+    warehouse.ConnectionPool = lambda **kwargs: state["warehouse"]
+    sys.modules["warehouse"] = warehouse
+
+    databricks = types.ModuleType("databricks")
+    sdk = types.ModuleType("databricks.sdk")
+    service = types.ModuleType("databricks.sdk.service")
+    dashboards = types.ModuleType("databricks.sdk.service.dashboards")
+    sdk.WorkspaceClient = lambda **kwargs: types.SimpleNamespace(
+        api_client=None, statement_execution=state["genie"].statement_execution)
+    dashboards.GenieAPI = lambda api_client: state["genie"]
+    databricks.sdk, sdk.service, service.dashboards = sdk, service, dashboards
+    sys.modules.update({
+        "databricks": databricks, "databricks.sdk": sdk,
+        "databricks.sdk.service": service, "databricks.sdk.service.dashboards": dashboards,
+    })
+
+
+# ----------------------------------------------------------------
+# SIMULATED SESSIONS
+# ----------------------------------------------------------------
+
+# AppTest swaps a process-global mock Runtime in and out around every run,
+# so two runs can't overlap: reruns take turns, as they would for the GIL
+# in one Streamlit server process. "latency" includes the wait for the
+# turn (what a user sees under load), "service" only the rerun itself.
+RUN_LOCK = threading.Lock()
+
+
+def timed_run(at, timings: dict, step: str, action=None):
+    queued = time.perf_counter()
+    with RUN_LOCK:
+        started = time.perf_counter()
+        (action or at.run)()
+        finished = time.perf_counter()
+    timings[step].append((finished - queued, finished - started))
+    if at.exception:
+        timings["exceptions"].append(step)
+
+
+def select_page(at, page: str):
+    return at.selectbox[0].set_value(page).run
+
+
+def run_session(session: int, args, timings: dict):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed + session)
+    at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=args.step_timeout)
+    timed_run(at, timings, "app.start")
+    for _ in range(args.iterations):
+        timed_run(at, timings, "map.load", select_page(at, "🗺️ Mapa Interativo"))
+        zoom = next(s for s in at.slider if s.label == "Zoom do mapa:")
+        timed_run(at, timings, "map.zoom", zoom.set_value(rng.choice([7, 9, 11, 12])).run)
+
+        timed_run(at, timings, "map3d.load", select_page(at, "🗺️ Mapa Interativo 3D"))
+        for _ in range(args.filter_changes):
+            bairro = next((m for m in at.multiselect if m.label == "Selecione o Bairro:"), None)
+            if bairro is None or not bairro.options:
+                break
+            values = rng.sample(list(bairro.options), k=min(len(bairro.options), rng.randint(0, 3)))
+            timed_run(at, timings, "map3d.filter", bairro.set_value(values).run)
+
+        timed_run(at, timings, "genie.load", select_page(at, "🤖 Chat com Genie"))
+        started = time.perf_counter()
+        timed_run(at, timings, "genie.submit", at.chat_input[0].set_value(rng.choice(QUESTIONS)).run)
+        # The status fragment reruns every second in the browser; AppTest reruns explicitly
+        while "genie_pending" in at.session_state and at.session_state["genie_pending"] is not None:
+            if time.perf_counter() - started > args.step_timeout:
+                break
+            time.sleep(0.25)
+            timed_run(at, timings, "genie.poll")
+        answered = time.perf_counter() - started
+        timings["genie.answer"].append((answered, answered))
+
+
+# ----------------------------------------------------------------
+# DRIVER
+# ----------------------------------------------------------------
+
+def bench_scale(rows: int, args, state: dict) -> dict:
+    import psutil
+    import streamlit as st
+
+    gold = build_gold(rows, args.source, args.seed)
+    state["warehouse"] = DuckDBWarehouse(gold, args.warehouse_latency_ms)
+    state["genie"] = FakeGenie(state["warehouse"], args.genie_latency)
+    del gold
+
+    # Cold start per scale: no Streamlit cache or disk result survives from the previous one
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    os.environ["RESULT_DISK_CACHE_DIR"] = tempfile.mkdtemp(prefix=f"bench_results_{rows}_")
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    timings = defaultdict(list)
+    peak = {"rss": rss_before}
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.wait(0.1):
+            peak["rss"] = max(peak["rss"], process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        for future in [pool.submit(run_session, i, args, timings) for i in range(args.sessions)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    rss_after = process.memory_info().rss
+
+    exceptions = timings.pop("exceptions", [])
+    steps = {}
+    for step, values in sorted(timings.items()):
+        latency, service = [v[0] * 1000 for v in values], [v[1] * 1000 for v in values]
+        steps[step] = {"count": len(values), "p50_ms": percentile(latency, 50), "p95_ms": percentile(latency, 95),
+                       "p99_ms": percentile(latency, 99), "service_p50_ms": percentile(service, 50)}
+    return {
+        "rows": rows,
+        "sessions": args.sessions,
+        "seconds": round(elapsed, 3),
+        "steps": steps,
+        "exceptions": {step: exceptions.count(step) for step in sorted(set(exceptions))},
+        "memory": {
+            "rss_before_mb": round(rss_before / 2**20, 1),
+            "rss_after_mb": round(rss_after / 2**20, 1),
+            "rss_peak_mb": round(peak["rss"] / 2**20, 1),
+            "per_session_mb": round((rss_after - rss_before) / 2**20 / args.sessions, 2),
+        },
+        "warehouse_calls": dict(state["warehouse"].calls),
+        "genie_calls": dict(state["genie"].calls),
+    }
+
+
+def print_report(result: dict):
+    print(f"\n== {result['rows']:,} rows | {result['sessions']} sessions | {result['seconds']:.1f}s ==")
+    print(f"{'step':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'svc p50':>10}")
+    for step, s in result["steps"].items():
+        print(f"{step:<16}{s['count']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['service_p50_ms']:>10.1f}")
+    print("memory:", result["memory"])
+    print("warehouse calls:", result["warehouse_calls"], "| genie calls:", result["genie_calls"])
+    if result["exceptions"]:
+        print("steps with app exceptions:", result["exceptions"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,1000000,10000000", help="gold table sizes, comma separated")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated sessions")
+    parser.add_argument("--iterations", type=int, default=2, help="scenario repetitions per session")
+    parser.add_argument("--filter-changes", type=int, default=5, help="filter clicks per 3D map visit")
+    parser.add_argument("--genie-latency", type=float, default=2.0, help="seconds until a Genie answer completes")
+    parser.add_argument("--warehouse-latency-ms", type=float, default=0.0, help="added to every warehouse call")
+    parser.add_argument("--step-timeout", type=float, default=120.0, help="AppTest timeout per rerun (s)")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="faturamento.csv used as the data model")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON report path (default: stdout only)")
+    args = parser.parse_args()
+
+    # AppTest runs without a server: silence the "no runtime / no ScriptRunContext" warnings
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    # app.yaml settings the app reads at import time
+    os.environ.setdefault("DATABRICKS_WAREHOUSE_ID", "benchmark")
+    os.environ.setdefault("GENIE_TIMEOUT", str(int(args.step_timeout)))
+    sys.path.insert(0, APP_DIR)
+
+    state = {}
+    install_stand_ins(state)
+    results = []
+    for rows in (int(r) for r in args.rows.split(",")):
+        result = bench_scale(rows, args, state)
+        print_report(result)
+        results.append(result)
+
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,23 @@
 # ----------------------------------------------------------------
 # MAIN APP WITH MULTI-PAGE NAVIGATION
 # ----------------------------------------------------------------
+# Heavy modules (keplergl, pydeck, pyarrow, Databricks SDK) are imported by the pages that use them
 import streamlit as st
 import pandas as pd
 import json
-import keplergl
+import hashlib
 import os
-from databricks import sql
-from databricks.sdk.core import Config
-from streamlit_keplergl import keplergl_static
-import h3
-import pydeck as pdk
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError
+import caching
+import filters
+import frames
+import geo
+import queries
+from metrics import Metrics
 
 # ----------------------------------------------------------------
 # PAGE CONFIGURATION
@@ -56,27 +63,281 @@ st.image(
     use_column_width=True
 )
 
+# ----------------------------------------------------------------
+# PERFORMANCE METRICS (SHARED)
+# ----------------------------------------------------------------
+
+RUN_STARTED = time.time()   # this script run's events are the ones shown in the debug panel
+
+@st.cache_resource
+def getMetrics() -> Metrics:
+    # Per-stage timings, rows, bytes and cache outcomes for the whole app process
+    return Metrics(
+        log_json=os.getenv('METRICS_LOG_JSON', 'false').lower() == 'true',
+        prometheus_file=os.getenv('METRICS_PROMETHEUS_FILE') or None,
+    )
+
 # ----------------------------------------------------------------
 # DATABASE CONNECTION (SHARED)
 # ----------------------------------------------------------------
 
 assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
 
-def sqlQuery(query: str) -> pd.DataFrame:
-    cfg = Config()
-    with sql.connect(
-        server_hostname=cfg.host,
-        http_path=f"/sql/1.0/warehouses/{os.getenv('DATABRICKS_WAREHOUSE_ID')}",
-        credentials_provider=lambda: cfg.authenticate
-    ) as connection:
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            return cursor.fetchall_arrow().to_pandas()
-
-@st.cache_data(ttl=30)
-def getData():
-     # Insira o nome da tabela criada
-    return sqlQuery("select * from academy.genie_aibi.gold_faturamento_h3")
+@st.cache_resource
+def getPool():
+    # One pool per app process, shared by every session and rerun
+    from warehouse import ConnectionPool
+    return ConnectionPool(
+        warehouse_id=os.getenv('DATABRICKS_WAREHOUSE_ID'),
+        size=int(os.getenv('SQL_POOL_SIZE', '4')),
+        query_timeout=int(os.getenv('SQL_QUERY_TIMEOUT', '60')),
+    )
+
+# Result files shared by every worker/replica on this host (Arrow IPC, LRU by last use)
+RESULT_DISK_CACHE_DIR = os.getenv('RESULT_DISK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lakehouse_app_results'))
+RESULT_DISK_CACHE_MB = int(os.getenv('RESULT_DISK_CACHE_MB', '2048'))
+
+@st.cache_resource
+def getDiskCache() -> caching.DiskResultCache:
+    return caching.DiskResultCache(RESULT_DISK_CACHE_DIR, RESULT_DISK_CACHE_MB * 1024 * 1024)
+
+def sqlArrow(query: str, parameters: dict = None, timeout: int = None, version=None):
+    # With a table `version`, the result is read from / written to the disk cache: a version
+    # only ever has one answer, so entries never go stale, they just age out of the LRU
+    with getMetrics().timed("sqlQuery") as span:
+        cache = getDiskCache() if version is not None else None
+        table = None
+        if cache is not None:
+            key = cache.key(query, parameters, version)
+            table = cache.get(key)
+            span["cache"] = "miss" if table is None else "hit"
+        if table is None:
+            table = getPool().query_arrow(query, parameters, timeout)
+            if cache is not None:
+                cache.put(key, table)
+        span["rows"], span["nbytes"] = table.num_rows, table.nbytes
+    return table
+
+def sqlQuery(query: str, parameters: dict = None, timeout: int = None, version=None) -> pd.DataFrame:
+    table = sqlArrow(query, parameters, timeout, version)
+    # split_blocks: numeric columns without nulls stay views over the mapped file
+    with getMetrics().timed("toPandas", rows=table.num_rows):
+        return table.to_pandas(split_blocks=True)
+
+# Insira o nome da tabela criada
+GOLD_TABLE = "academy.genie_aibi.gold_faturamento_h3"
+
+# Aggregate cube for KPIs and filter options (lab01_gold_h3.py); empty: read them from the gold table
+CUBE_TABLE = os.getenv('CUBE_TABLE', 'academy.genie_aibi.gold_faturamento_cubo')
+
+# Maximum hexagons sent to the browser per map frame
+MAP_MAX_CELLS = int(os.getenv('MAP_MAX_CELLS', '50000'))
+
+# How often the gold table version is checked (a metadata query, no data scan)
+VERSION_CHECK_SECONDS = int(os.getenv('VERSION_CHECK_SECONDS', '10'))
+
+# Memory budget of the versioned gold result store (all sessions)
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', '512'))
+
+@st.cache_data(ttl=VERSION_CHECK_SECONDS)
+def getTableVersion(table: str = GOLD_TABLE):
+    # Current Delta version of the table; if the history can't be read (e.g. a
+    # materialized view), a 30 s time bucket stands in for it (the old TTL behavior)
+    try:
+        return int(sqlQuery(queries.build_version(table))["version"].iloc[0])
+    except Exception:
+        return f"ttl-{int(time.time() // 30)}"
+
+@st.cache_resource
+def getResultStore() -> caching.LRUCache:
+    # query key -> (table version, frame), shared by every session and bounded by frame memory
+    return caching.LRUCache(
+        max_bytes=RESULT_CACHE_MB * 1024 * 1024,
+        sizeof=lambda entry: entry[1].attrs["nbytes"],
+    )
+
+def fetchChanges(cached: pd.DataFrame, from_version: int, to_version: int, columns: tuple, filters: tuple,
+                 group_by: tuple, resolution: int, limit: int, h3_ranges: tuple) -> pd.DataFrame:
+    # Rows changed between the two versions (change data feed), merged into the cached aggregate
+    query, parameters = queries.build_changes(GOLD_TABLE, columns, from_version, to_version,
+                                              filters, group_by, resolution, h3_ranges)
+    df = queries.merge_changes(cached, sqlQuery(query, parameters, version=to_version))
+    if limit and len(df) > limit:
+        metric = next(c for c in columns if c in queries.METRICS)
+        df = df.nlargest(limit, metric).reset_index(drop=True)
+    return df
+
+def getData(columns: tuple = queries.GOLD_COLUMNS, filters: tuple = (), group_by: tuple = (),
+            resolution: int = queries.H3_RESOLUTION, limit: int = None, h3_ranges: tuple = ()) -> pd.DataFrame:
+    # Cached per (columns, normalized filters, grouping, resolution, viewport) and kept while the
+    # table version doesn't move; a new version pulls only the changed rows when possible.
+    # The frame is shared between sessions and compact (see frames.py): treat it as read-only.
+    with getMetrics().timed("getData") as span:
+        df, span["cache"] = _getData(columns, filters, group_by, resolution, limit, h3_ranges)
+        span["rows"], span["nbytes"] = len(df), df.attrs["nbytes"]
+    return df
+
+def _getData(columns: tuple, filters: tuple, group_by: tuple, resolution: int, limit: int, h3_ranges: tuple) -> tuple:
+    # (frame, outcome): "hit" from the store, "delta" merged from the change feed, "miss" queried in full
+    key = (columns, filters, group_by, resolution, limit, h3_ranges)
+    version = getTableVersion()
+    store = getResultStore()
+    cached = store.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1], "hit"
+
+    df = None
+    incremental = (
+        cached is not None and isinstance(cached[0], int) and isinstance(version, int)
+        and cached[0] < version and (group_by or resolution != queries.H3_RESOLUTION)
+        and (not limit or len(cached[1]) < limit)   # a top-N cut may hide groups that grew
+    )
+    if incremental:
+        try:
+            df = fetchChanges(cached[1], cached[0], version, columns, filters, group_by, resolution, limit, h3_ranges)
+        except Exception:
+            df = None   # change data feed off or history vacuumed: read everything again
+    query, parameters = queries.build_select(GOLD_TABLE, columns, filters, group_by, resolution, limit, h3_ranges)
+    if df is None:
+        table, outcome = sqlArrow(query, parameters, version=version), "miss"
+        with getMetrics().timed("compactFrame", rows=table.num_rows, arrow_bytes=table.nbytes) as span:
+            df = frames.compact_arrow(table)
+            span["nbytes"] = frames.memory_report(df)["bytes"]
+        del table
+    else:
+        outcome = "delta"
+        with getMetrics().timed("compactFrame", rows=len(df)) as span:
+            df = frames.compact_frame(df)
+            span["nbytes"] = frames.memory_report(df)["bytes"]
+        # the merged frame is this version's answer: other workers read it from disk
+        import pyarrow as pa
+        disk = getDiskCache()
+        disk.put(disk.key(query, parameters, version), pa.Table.from_pandas(df, preserve_index=False))
+    df.attrs["nbytes"] = span["nbytes"]
+    with getMetrics().timed("frameFingerprint", rows=len(df)):
+        df.attrs["fingerprint"] = geo.frame_fingerprint(df)   # computed once per version, travels with the frame
+    store.put(key, (version, df))
+    return df, outcome
+
+@st.cache_resource(max_entries=32)
+def prepareMapData(_df: pd.DataFrame, fingerprint: str, numeric_cols: tuple, required: tuple) -> pd.DataFrame:
+    # Keyed by the data fingerprint: every page and rerun over the same data reuses the
+    # prepared frame. cache_resource hands back the same (read-only) object, no copy.
+    with getMetrics().timed("prepareMapData", rows=len(_df), cache="miss"):
+        return geo.prepare_map_frame(_df, numeric_cols, required)
+
+@st.cache_resource(max_entries=32)
+def prepareDeckData(_df: pd.DataFrame, data_key: str, tooltip_cols: tuple) -> pd.DataFrame:
+    # Only what the H3HexagonLayer draws or shows travels to the browser
+    with getMetrics().timed("prepareDeckData", rows=len(_df), cache="miss"):
+        return geo.deck_frame(_df, "contagem_clientes", "valor_inadimplencia", tooltip_cols)
+
+# Largest map dataset filtered in memory; above it filters go to the warehouse
+FILTER_INDEX_MAX_ROWS = int(os.getenv('FILTER_INDEX_MAX_ROWS', '2000000'))
+
+@st.cache_resource(max_entries=8)
+def getFilterIndex(_df: pd.DataFrame, fingerprint: str, group_cols: tuple, metrics: tuple) -> filters.FilterIndex:
+    # Built once per dataset version: categorical codes, value bitmaps and sorted option lists
+    with getMetrics().timed("buildFilterIndex", rows=len(_df), cache="miss"):
+        return filters.FilterIndex(_df, queries.DIMENSIONS, group_cols, metrics)
+
+@st.cache_data(ttl=300)
+def getSummaryTable() -> str:
+    # The cube while it can be read (a few thousand rows: KPIs in milliseconds), else the gold detail rows
+    if CUBE_TABLE:
+        try:
+            sqlQuery(f"SELECT 1 FROM {CUBE_TABLE} LIMIT 1")
+            return CUBE_TABLE
+        except Exception:
+            pass
+    return GOLD_TABLE
+
+@st.cache_data(max_entries=64)
+def getTotals(table: str, filters: tuple = (), version=None) -> pd.Series:
+    # `version` only keys the cache: totals are recomputed when the table changes
+    query, parameters = queries.build_totals(table, filters)
+    return sqlQuery(query, parameters, version=version).iloc[0]
+
+@st.cache_data(max_entries=64)
+def getBreakdown(table: str, dimension: str, filters: tuple = (), version=None) -> pd.DataFrame:
+    query, parameters = queries.build_breakdown(table, dimension, filters)
+    return sqlQuery(query, parameters, version=version)
+
+@st.cache_data(max_entries=16)
+def getFilterOptions(table: str, version=None) -> dict:
+    options = sqlQuery(queries.build_options(table), version=version)
+    return {dim: sorted(group["value"]) for dim, group in options.groupby("dim")}
+
+# ----------------------------------------------------------------
+# MAP LEVEL OF DETAIL (SHARED)
+# ----------------------------------------------------------------
+
+# Initial map center (São Paulo) shared by both map pages
+MAP_CENTER = (-23.65, -46.65)
+
+@st.cache_data
+def getViewportRanges(latitude: float, longitude: float, zoom: int) -> tuple:
+    # H3 key ranges of the visible area; cheap, but cached per view anyway
+    return geo.viewport_ranges(geo.viewport_bbox(latitude, longitude, zoom), queries.H3_RESOLUTION)
+
+def levelOfDetail(default_zoom: int) -> tuple:
+    # Zoom picks the H3 resolution: wide views get parent cells rolled up on the warehouse
+    col_zoom, col_lod, col_view = st.columns([2, 1, 1])
+    with col_zoom:
+        zoom = st.slider("Zoom do mapa:", min_value=5, max_value=13, value=default_zoom)
+    with col_lod:
+        auto_lod = st.toggle("Nível de detalhe automático", value=True)
+    with col_view:
+        # The maps don't report pan/zoom back to Streamlit: the "visible area" is the
+        # initial view around MAP_CENTER, so it is opt-in to keep the rest of the data loadable
+        only_visible = st.toggle("Somente a área visível", value=False,
+                                 help="Carrega apenas a região da visão inicial do mapa (centro e zoom atuais).")
+    resolution = geo.resolution_for_zoom(zoom, finest=queries.H3_RESOLUTION) if auto_lod else queries.H3_RESOLUTION
+    h3_ranges = getViewportRanges(*MAP_CENTER, zoom) if only_visible else ()
+    st.caption(f"Resolução H3: {resolution:02d} | máximo de {MAP_MAX_CELLS:,} hexágonos por mapa")
+    return zoom, resolution, h3_ranges
+
+# ----------------------------------------------------------------
+# KEPLER.GL RENDER CACHE (SHARED)
+# ----------------------------------------------------------------
+
+@st.cache_resource
+def getKeplerHtmlCache() -> caching.LRUCache:
+    # Process-wide LRU of rendered maps, bounded by total HTML size
+    return caching.LRUCache(max_bytes=int(os.getenv('KEPLER_HTML_CACHE_MB', '256')) * 1024 * 1024)
+
+def keplerColumns(config: dict) -> list:
+    # Columns the map actually reads: layer columns, color field and tooltip fields
+    columns = []
+    for layer in config["config"]["visState"]["layers"]:
+        columns += layer["config"]["columns"].values()
+        columns.append(layer["config"]["colorField"]["name"])
+    for fields in config["config"]["visState"]["interactionConfig"]["tooltip"]["fieldsToShow"].values():
+        columns += [f["name"] for f in fields]
+    return list(dict.fromkeys(columns))
+
+def renderKeplerHtml(final_df: pd.DataFrame, fingerprint: str, config: dict, data_id: str) -> str:
+    # Same data + same config -> same HTML: serialize once, reuse for every visitor and rerun
+    config_hash = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    with getMetrics().timed("renderKeplerHtml", rows=len(final_df), cache="hit") as span:
+        def build():
+            import keplergl
+            span["cache"] = "miss"
+            kepler_map = keplergl.KeplerGl(height=600, config=config)
+            # H3 ids become hex strings only here, for the rendered columns
+            kepler_map.add_data(data=geo.with_h3_hex(final_df[keplerColumns(config)]), name=data_id)
+            return kepler_map._repr_html_()
+
+        html = getKeplerHtmlCache().get_or_create((fingerprint, config_hash), build)
+        span["nbytes"] = len(html)
+        return html
+
+def mapColumns(resolution: int, fine_columns: tuple, metrics: tuple) -> tuple:
+    # Rolled-up cells mix several bairros/genders: keep only the hexagon and the metrics
+    if resolution == queries.H3_RESOLUTION:
+        return (queries.H3_COLUMN, *fine_columns, *metrics)
+    return (queries.H3_COLUMN, *metrics)
 
 # ----------------------------------------------------------------
 # PAGE ROUTING
@@ -89,11 +350,22 @@ if page == "🗺️ Mapa Interativo":
     
     st.subheader("🗺️ Monitoramento das áreas de inadimplência")
     
+    zoom, resolution, h3_ranges = levelOfDetail(default_zoom=11)
+    
     try:
-        df = getData()
-        if 'contagem_clientes' in df.columns:
-            total_clientes = int(df['contagem_clientes'].sum())
-            st.success(f"Total de clientes inadimplentes: {total_clientes:,}")
+        summary_table = getSummaryTable()
+        totals = getTotals(summary_table, version=getTableVersion(summary_table))
+        total_clientes = int(totals.fillna(0)['contagem_clientes'])
+        st.success(f"Total de clientes inadimplentes: {total_clientes:,}")
+        # Only the hexagon, the color metric and the tooltip leave the warehouse
+        columns = mapColumns(resolution, ("bairro",), ("contagem_clientes",))
+        df = getData(
+            columns=columns,
+            group_by=tuple(c for c in columns if c not in queries.METRICS),
+            resolution=resolution,
+            limit=MAP_MAX_CELLS,
+            h3_ranges=h3_ranges,
+        )
     except Exception as e:
         st.error(f"Erro carregando os dados: {e}")
         st.stop()
@@ -101,29 +373,16 @@ if page == "🗺️ Mapa Interativo":
     if df.empty:
         st.error("Nenhum dado encontrado!")
         st.stop()
+    if len(df) >= MAP_MAX_CELLS:
+        st.info(f"Exibindo os {MAP_MAX_CELLS:,} hexágonos com mais clientes. Reduza o zoom para ver a área toda agregada.")
     
     # --- Data Processing ---
-    h3_column = next((col for col in df.columns if 'h3' in col.lower()), None)
-    if not h3_column:
-        st.error("Nenhuma coluna H3 encontrada!")
+    try:
+        final_df = prepareMapData(df, df.attrs["fingerprint"], ("contagem_clientes",), ("h3", "contagem_clientes"))
+    except KeyError as e:
+        st.error(e.args[0])
         st.stop()
     
-    def convert_h3_simple(x):
-        if pd.isna(x): return None
-        try:
-            return format(int(x), '0>15x') if isinstance(x, (int, float)) else str(x)
-        except (ValueError, TypeError):
-            return None
-
-    # Include all required columns in the DataFrame
-    final_df = df.copy()
-    final_df['h3'] = final_df[h3_column].apply(convert_h3_simple)
-    final_df["contagem_clientes"] = pd.to_numeric(final_df.get("contagem_clientes"), errors="coerce")
-    
-    # Ensure all necessary columns exist and are clean
-    required_cols = ['h3', 'contagem_clientes', 'genero_cliente', 'bairro', 'faixa_divida']
-    final_df.dropna(subset=required_cols, inplace=True)
-    
     # --- Kepler Configuration ---
     kepler_config = {
         "version": "v1",
@@ -160,8 +419,8 @@ if page == "🗺️ Mapa Interativo":
                     "tooltip": {
                         "fieldsToShow": {
                             "inadimplencia_data": [
-                                {"name": "contagem_clientes", "format": None},
-                                {"name": "bairro", "format": None}
+                                {"name": field, "format": None}
+                                for field in ("contagem_clientes", "bairro") if field in final_df.columns
                             ]
                         },
                         "enabled": True
@@ -169,9 +428,9 @@ if page == "🗺️ Mapa Interativo":
                 }
             },
             "mapState": {
-                "latitude": -23.65,
-                "longitude": -46.65,
-                "zoom": 11,
+                "latitude": MAP_CENTER[0],
+                "longitude": MAP_CENTER[1],
+                "zoom": zoom,
                 "pitch": 0,
                 "bearing": 0
             }
@@ -180,11 +439,7 @@ if page == "🗺️ Mapa Interativo":
 
     # --- Display Map ---
     try:
-        map_1 = keplergl.KeplerGl(height=600, config=kepler_config)
-        # CHANGE: Pass the full DataFrame with all columns to the map
-        map_1.add_data(data=final_df, name="inadimplencia_data")
-        
-        map_html = map_1._repr_html_()
+        map_html = renderKeplerHtml(final_df, df.attrs["fingerprint"], kepler_config, "inadimplencia_data")
         st.components.v1.html(map_html, height=600)
 
     except Exception as e:
@@ -196,47 +451,41 @@ if page == "🗺️ Mapa Interativo 3D":
     # MAP PAGE WITH PYDECK AND INTERACTIVE FILTERS
     # ----------------------------------------------------------------
     
+    import pydeck as pdk
+
     st.subheader("🗺️ Mapa Interativo de Inadimplência")
     
+    zoom, resolution, h3_ranges = levelOfDetail(default_zoom=9)
+    metrics = ('contagem_clientes', 'valor_inadimplencia')
+    display_cols = tuple(c for c in mapColumns(resolution, ('genero_cliente', 'bairro'), ()) if c != queries.H3_COLUMN)
+    
     try:
-        df = getData()
-        if 'contagem_clientes' in df.columns:
-            total_clientes = int(df['contagem_clientes'].sum())
-            st.success(f"Total de clientes inadimplentes: {total_clientes:,}")
-
+        summary_table = getSummaryTable()
+        summary_version = getTableVersion(summary_table)
+        totals = getTotals(summary_table, version=summary_version)
+        total_clientes = int(totals.fillna(0)['contagem_clientes'])
+        st.success(f"Total de clientes inadimplentes: {total_clientes:,}")
+        # Every filter dimension at the map grain: filter clicks are answered in memory while it fits
+        base_df = getData(
+            columns=(queries.H3_COLUMN, *queries.DIMENSIONS, *metrics),
+            group_by=(queries.H3_COLUMN, *queries.DIMENSIONS),
+            resolution=resolution,
+            limit=FILTER_INDEX_MAX_ROWS + 1,
+            h3_ranges=h3_ranges,
+        )
+        local_filters = len(base_df) <= FILTER_INDEX_MAX_ROWS
+        if local_filters:
+            base_map_df = prepareMapData(base_df, base_df.attrs["fingerprint"], metrics, ("h3", *metrics))
+            filter_index = getFilterIndex(base_map_df, base_df.attrs["fingerprint"], ("h3", *display_cols), metrics)
+        # Option lists from the cube (all values, stable across zoom levels); without it, from the loaded rows
+        if summary_table == CUBE_TABLE or not local_filters:
+            filter_options = getFilterOptions(summary_table, summary_version)
+        else:
+            filter_options = filter_index.options
     except Exception as e:
         st.error(f"Erro carregando os dados: {e}")
         st.stop()
     
-    if df.empty:
-        st.warning("Nenhum dado encontrado para exibir.")
-        st.stop()
-    
-    # --- Data Processing ---
-    h3_column = next((col for col in df.columns if 'h3' in col.lower()), None)
-    if not h3_column:
-        st.error("Nenhuma coluna H3 encontrada no DataFrame!")
-        st.stop()
-
-    def convert_h3_simple(x):
-        if pd.isna(x): return None
-        try:
-            return format(int(x), '0>15x') if isinstance(x, (int, float)) else str(x)
-        except (ValueError, TypeError):
-            return None
-
-    final_df = df.copy()
-    final_df['h3'] = final_df[h3_column].apply(convert_h3_simple)
-    for col in ['contagem_clientes', 'valor_inadimplencia', 'genero_cliente', 'bairro', 'faixa_divida']:
-        if col in final_df.columns:
-            if col in ['contagem_clientes', 'valor_inadimplencia']:
-                 final_df[col] = pd.to_numeric(final_df[col], errors="coerce")
-        else:
-            st.error(f"Coluna necessária '{col}' não encontrada no DataFrame.")
-            st.stop()
-            
-    final_df.dropna(subset=['h3', 'contagem_clientes', 'valor_inadimplencia'], inplace=True)
-    
     st.markdown("---")
 
     # --- 1. Filter Controls (with no default selection) ---
@@ -244,52 +493,94 @@ if page == "🗺️ Mapa Interativo 3D":
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        unique_genders = sorted(final_df['genero_cliente'].unique())
         selected_genders = st.multiselect(
             "Selecione o Gênero:",
-            options=unique_genders,
+            options=filter_options.get('genero_cliente', []),
         )
 
     with col2:
-        unique_bairros = sorted(final_df['bairro'].unique())
         selected_bairros = st.multiselect(
             "Selecione o Bairro:",
-            options=unique_bairros,
+            options=filter_options.get('bairro', []),
         )
 
     with col3:
-        unique_faixas = sorted(final_df['faixa_divida'].unique())
         selected_faixas = st.multiselect(
             "Selecione a Faixa de Dívida:",
-            options=unique_faixas,
+            options=filter_options.get('faixa_divida', []),
         )
     
-    # --- 2. Apply Filters to the DataFrame ---
-    filtered_df = final_df
-    if selected_genders:
-        filtered_df = filtered_df[filtered_df['genero_cliente'].isin(selected_genders)]
-    if selected_bairros:
-        filtered_df = filtered_df[filtered_df['bairro'].isin(selected_bairros)]
-    if selected_faixas:
-        filtered_df = filtered_df[filtered_df['faixa_divida'].isin(selected_faixas)]
+    # --- 2. Apply Filters (filter index in memory, or parameterized WHERE on the warehouse) ---
+    selection = queries.normalize_filters({
+        'genero_cliente': selected_genders,
+        'bairro': selected_bairros,
+        'faixa_divida': selected_faixas,
+    })
+
+    # --- Selection KPIs (from the aggregate cube: no detail rows are read) ---
+    if selection:
+        try:
+            selected = getTotals(summary_table, selection, summary_version).fillna(0)
+            by_faixa = getBreakdown(summary_table, 'faixa_divida', selection, summary_version)
+        except Exception as e:
+            st.warning(f"Resumo da seleção indisponível: {e}")
+        else:
+            clientes, valor = int(selected['contagem_clientes']), float(selected['valor_inadimplencia'])
+            kpi1, kpi2, kpi3 = st.columns(3)
+            kpi1.metric("Clientes na seleção", f"{clientes:,}")
+            kpi2.metric("Valor da inadimplência", f"R$ {valor:,.2f}")
+            kpi3.metric("Dívida média por cliente", f"R$ {valor / clientes:,.2f}" if clientes else "-")
+            st.bar_chart(by_faixa.set_index('faixa_divida')['contagem_clientes'], height=200)
+    if local_filters:
+        with getMetrics().timed("filterIndex.apply", rows=filter_index.n_rows):
+            filtered_df = filter_index.apply(dict(selection), limit=MAP_MAX_CELLS)
+        data_key = f"{base_df.attrs['fingerprint']}:{selection}"
+        truncated = len(filtered_df) >= MAP_MAX_CELLS
+    else:
+        try:
+            df = getData(
+                columns=(queries.H3_COLUMN, *display_cols, *metrics),
+                filters=selection,
+                group_by=(queries.H3_COLUMN, *display_cols),
+                resolution=resolution,
+                limit=MAP_MAX_CELLS,
+                h3_ranges=h3_ranges,
+            )
+            filtered_df = prepareMapData(df, df.attrs["fingerprint"], metrics, ("h3", *metrics))
+        except KeyError as e:
+            st.error(e.args[0])
+            st.stop()
+        except Exception as e:
+            st.error(f"Erro carregando os dados: {e}")
+            st.stop()
+        data_key = df.attrs["fingerprint"]
+        truncated = len(df) >= MAP_MAX_CELLS
 
     if filtered_df.empty:
         st.warning("Nenhum dado corresponde aos filtros selecionados. Por favor, ajuste sua seleção.")
         st.stop()
+    if truncated:
+        st.info(f"Exibindo os {MAP_MAX_CELLS:,} hexágonos com mais clientes. Reduza o zoom ou aplique filtros para ver o restante.")
 
     # --- 3. Pydeck Configuration (uses 'filtered_df') ---
     view_state = pdk.ViewState(
-        latitude=-23.65, longitude=-46.65, zoom=9, pitch=50, bearing=0
+        latitude=MAP_CENTER[0], longitude=MAP_CENTER[1], zoom=zoom, pitch=50, bearing=0
     )
 
-    max_contagem = filtered_df['contagem_clientes'].max()
-    if max_contagem == 0: max_contagem = 1
+    tooltip_fields = {
+        "contagem_clientes": "Contagem de Clientes",
+        "valor_inadimplencia": "Valor da Inadimplência",
+        "bairro": "Bairro",
+        "genero_cliente": "Gênero",
+    }
+    tooltip_fields = {field: label for field, label in tooltip_fields.items() if field in filtered_df.columns}
+    deck_df = prepareDeckData(filtered_df, data_key, tuple(tooltip_fields))
 
     h3_layer = pdk.Layer(
         "H3HexagonLayer",
-        data=filtered_df,
+        data=deck_df,
         get_hexagon="h3",
-        get_fill_color=f"[255, 255 * (1 - contagem_clientes / {max_contagem}), 0, 180]",
+        get_fill_color="color",
         get_elevation="valor_inadimplencia",
         extruded=True,
         elevation_scale=0.1,
@@ -298,23 +589,20 @@ if page == "🗺️ Mapa Interativo 3D":
     )
 
     tooltip = {
-       "html": """
-            <b>Contagem de Clientes:</b> {contagem_clientes} <br/>
-            <b>Valor da Inadimplência:</b> {valor_inadimplencia} <br/>
-            <b>Bairro:</b> {bairro} <br/>
-            <b>Gênero:</b> {genero_cliente}
-            """,
+       "html": " <br/>".join(f"<b>{label}:</b> {{{field}}}" for field, label in tooltip_fields.items()),
        "style": {"backgroundColor": "steelblue", "color": "white"}
     }
 
     # --- 4. Render the map in Streamlit ---
     try:
-        st.pydeck_chart(pdk.Deck(
-            layers=[h3_layer],
-            initial_view_state=view_state,
-            map_style=pdk.map_styles.LIGHT,
-            tooltip=tooltip
-        ))
+        # Deck JSON serialization + send to the browser
+        with getMetrics().timed("pydeckChart", rows=len(deck_df)):
+            st.pydeck_chart(pdk.Deck(
+                layers=[h3_layer],
+                initial_view_state=view_state,
+                map_style=pdk.map_styles.LIGHT,
+                tooltip=tooltip
+            ))
     except Exception as e:
         st.error(f"Ocorreu um erro ao renderizar o mapa com Pydeck: {e}")
 
@@ -323,66 +611,102 @@ elif page == "🤖 Chat com Genie":
     # ----------------------------------------------------------------
     # GENIE CHAT PAGE
     # ----------------------------------------------------------------
-    import json
-    from databricks.sdk import WorkspaceClient
-    from databricks.sdk.service.dashboards import GenieAPI
+    import genie
 
     # Insira o ID do Genie Space criado anteriormente
     genie_space_id = "<INSIRA-AQUI-O-ID-DO-GENIE-SPACE>"
 
-    workspace_client = WorkspaceClient(
-        host=os.environ.get("DATABRICKS_HOST"),
-        client_id=os.environ.get("DATABRICKS_CLIENT_ID"),
-        client_secret=os.environ.get("DATABRICKS_CLIENT_SECRET"),
-    )
-    genie_api = GenieAPI(workspace_client.api_client)
+    @st.cache_resource
+    def getGenieClient() -> genie.GenieClient:
+        # One background event loop + bounded executor per app process, shared by every session
+        from databricks.sdk import WorkspaceClient
+        workspace_client = WorkspaceClient(
+            host=os.environ.get("DATABRICKS_HOST"),
+            client_id=os.environ.get("DATABRICKS_CLIENT_ID"),
+            client_secret=os.environ.get("DATABRICKS_CLIENT_SECRET"),
+        )
+        return genie.GenieClient(
+            workspace_client,
+            max_workers=int(os.getenv('GENIE_MAX_WORKERS', '8')),
+            timeout=int(os.getenv('GENIE_TIMEOUT', '120')),
+        )
+
+    # Repeated questions: answers reused per (space, normalized question, table version)
+    GENIE_CACHE_RERUN_SQL = os.getenv('GENIE_CACHE_RERUN_SQL', 'false').lower() == 'true'
+
+    @st.cache_resource
+    def getGenieAnswerCache() -> caching.LRUCache:
+        # Shared by every session; with GENIE_CACHE_RERUN_SQL only the SQL and description are kept
+        return caching.LRUCache(
+            max_bytes=int(os.getenv('GENIE_CACHE_MB', '64')) * 1024 * 1024,
+            sizeof=lambda answer: len(pickle.dumps(answer)),
+            ttl=int(os.getenv('GENIE_CACHE_TTL', '3600')),
+        )
+
+    genie_client = getGenieClient()
+    answer_cache = getGenieAnswerCache()
     conversation_id = st.session_state.get("genie_conversation_id", None)
 
-    def ask_genie_sync(question: str, space_id: str, conversation_id: str = None):
-        import asyncio
+    def cache_answer(cache_key: tuple, answer_json: dict):
+        if GENIE_CACHE_RERUN_SQL and answer_json.get("sql"):
+            answer_json = {k: v for k, v in answer_json.items() if k not in ("dataframe", "truncated")}
+        answer_cache.put(cache_key, answer_json)
+
+    def replay_answer(cached: dict) -> dict:
+        # Cached answer as is, or (GENIE_CACHE_RERUN_SQL) its SQL run again on the warehouse
+        answer_json = dict(cached, cached=True)
+        if GENIE_CACHE_RERUN_SQL and cached.get("sql"):
+            try:
+                answer_json["dataframe"] = sqlQuery(cached["sql"], version=getTableVersion())
+            except Exception as e:
+                answer_json["message"] = f"Erro executando o SQL em cache: {str(e)}"
+        return answer_json
+
+    def collect_answer(request: genie.GenieRequest) -> tuple:
+        # (answer_json, succeeded): only successful answers are cached
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            if conversation_id is None:
-                initial_message = loop.run_until_complete(
-                    loop.run_in_executor(None, genie_api.start_conversation_and_wait, space_id, question)
-                )
-                conversation_id_local = initial_message.conversation_id
-            else:
-                initial_message = loop.run_until_complete(
-                    loop.run_in_executor(None, genie_api.create_message_and_wait, space_id, conversation_id, question)
-                )
-                conversation_id_local = conversation_id
-            
-            answer_json = {"message": ""}
-            # Possible text attachment
-            for attachment in initial_message.attachments:
-                if getattr(attachment, "text", None) and getattr(attachment.text, "content", None):
-                    answer_json["message"] = attachment.text.content
-                    break
-                if getattr(attachment, "query", None):
-                    # Attempt to retrieve and display query & results
-                    query_result = loop.run_until_complete(
-                        loop.run_in_executor(None, genie_api.get_message_query_result,
-                            space_id, initial_message.conversation_id, initial_message.id)
-                    ) if hasattr(genie_api, "get_message_query_result") else None
-                    # Get actual SQL result if present
-                    if query_result and hasattr(query_result, "statement_response") and query_result.statement_response:
-                        sql_results = loop.run_until_complete(
-                            loop.run_in_executor(None, workspace_client.statement_execution.get_statement,
-                                query_result.statement_response.statement_id)
-                        )
-                        answer_json["columns"] = sql_results.manifest.schema.as_dict()
-                        answer_json["data"] = sql_results.result.as_dict()
-                        desc = getattr(attachment.query, "description", "")
-                        answer_json["query_description"] = desc
-                        answer_json["sql"] = getattr(attachment.query, "query", "")
-                        break
-            loop.close()
-            return answer_json, conversation_id_local
+            answer_json, new_conversation_id = request.result()
+            st.session_state["genie_conversation_id"] = new_conversation_id
+            return answer_json, True
+        except CancelledError:
+            return {"message": "Pergunta cancelada."}, False
         except Exception as e:
-            return {"message": f"Erro consultando Genie: {str(e)}"}, conversation_id
-    
+            return {"message": f"Erro consultando Genie: {str(e)}"}, False
+
+    # Rows kept from a Genie result (the table is streamed in as the chunks arrive)
+    GENIE_MAX_ROWS = int(os.getenv('GENIE_MAX_ROWS', '100000'))
+
+    def stream_result(answer_json: dict) -> dict:
+        # Typed Arrow chunks fetched in parallel, drawn progressively; the final frame replaces the statement id
+        # Each chunk is converted once and appended to the table on screen (add_rows)
+        statement_id = answer_json.pop("statement_id")
+        slot = st.empty()
+        with slot.container():
+            progress, grid = st.empty(), st.empty()
+        chunks, rows, nbytes, table_view = [], 0, 0, None
+        with getMetrics().timed("genie.result") as span:
+            try:
+                for table in genie_client.iter_result(statement_id, max_rows=GENIE_MAX_ROWS + 1):
+                    chunk = table.to_pandas()
+                    chunk.index += rows
+                    chunks.append(chunk)
+                    rows += table.num_rows
+                    nbytes += table.nbytes
+                    progress.caption(f"Carregando resultado... {rows:,} linhas")
+                    if table_view is None:
+                        table_view = grid.dataframe(chunk)
+                    else:
+                        table_view.add_rows(chunk)
+            except Exception as e:
+                answer_json["message"] = f"Erro lendo o resultado da consulta: {str(e)}"
+            span["rows"], span["nbytes"] = rows, nbytes
+        slot.empty()
+        if chunks:
+            df = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+            answer_json["truncated"] = len(df) > GENIE_MAX_ROWS
+            answer_json["dataframe"] = df.iloc[:GENIE_MAX_ROWS]
+        return answer_json
+
     def process_query_results(answer_json):
         response_blocks = []
         if "query_description" in answer_json and answer_json["query_description"]:
@@ -390,16 +714,13 @@ elif page == "🤖 Chat com Genie":
         if "sql" in answer_json:
             with st.expander("SQL gerado pelo Genie"):
                 st.code(answer_json["sql"], language="sql")
-        if "columns" in answer_json and "data" in answer_json:
-            columns = answer_json["columns"]
-            data = answer_json["data"]
-            # Safe check for correct structure
-            if isinstance(columns, dict) and "columns" in columns:
-                # Render Pandas DataFrame in Streamlit
-                col_names = [col["name"] for col in columns["columns"]]
-                df = pd.DataFrame(data["data_array"], columns=col_names)
-                st.markdown("**Resultados da Consulta:**")
-                st.dataframe(df)
+        if answer_json.get("cached"):
+            st.caption("⚡ Resposta reaproveitada do cache")
+        if "dataframe" in answer_json:
+            st.markdown("**Resultados da Consulta:**")
+            st.dataframe(answer_json["dataframe"])
+            if answer_json.get("truncated"):
+                st.caption(f"Exibindo as primeiras {GENIE_MAX_ROWS:,} linhas do resultado.")
         elif "message" in answer_json:
             st.markdown(answer_json["message"])
         else:
@@ -410,16 +731,62 @@ elif page == "🤖 Chat com Genie":
     st.subheader("🤖 Genie: IA para consulta dos dados")
     st.markdown("Pergunte o que quiser sobre o dataset de inadimplência e obtenha insights em linguagem natural!")
 
-    user_input = st.chat_input("Faça uma pergunta para Genie...")
-
-    if user_input:
-        st.chat_message("user").markdown(user_input)
-        # Call Genie API and display response
+    history = st.session_state.setdefault("genie_history", [])
+    for question, answer_json in history:
+        st.chat_message("user").markdown(question)
+        with st.chat_message("assistant"):
+            process_query_results(answer_json)
+
+    # A finished pending question: its rows are streamed in, then it joins the history
+    pending = st.session_state.get("genie_pending")
+    if pending is not None and pending.done():
+        answer_json, succeeded = collect_answer(pending)
+        getMetrics().record("genie.ask", pending.elapsed, cache="miss", status=pending.status)
+        st.chat_message("user").markdown(pending.question)
         with st.chat_message("assistant"):
-            with st.spinner("Consultando Genie..."):
-                answer_json, new_conversation_id = ask_genie_sync(user_input, genie_space_id, conversation_id)
-                st.session_state["genie_conversation_id"] = new_conversation_id
-                process_query_results(answer_json)
+            if "statement_id" in answer_json:
+                answer_json = stream_result(answer_json)
+                succeeded = succeeded and "dataframe" in answer_json
+            process_query_results(answer_json)
+        if succeeded and st.session_state.get("genie_pending_key") is not None:
+            cache_answer(st.session_state["genie_pending_key"], answer_json)
+        history.append((pending.question, answer_json))
+        st.session_state["genie_pending"] = pending = None
+
+    user_input = st.chat_input("Faça uma pergunta para Genie...", disabled=pending is not None)
+
+    if user_input and pending is None:
+        # Only opening questions are cached: a follow-up ("e no mês anterior?") depends on
+        # the earlier turns, so its answer can't be shared with other conversations
+        first_turn = conversation_id is None and not history
+        cache_key = (genie_space_id, genie.normalize_question(user_input), getTableVersion()) if first_turn else None
+        cached = answer_cache.get(cache_key) if first_turn else None
+        if cached is not None:
+            with getMetrics().timed("genie.ask", cache="hit"):
+                history.append((user_input, replay_answer(cached)))
+            st.rerun()
+        # Returns at once: Genie runs on the background loop
+        pending = genie_client.ask(user_input, genie_space_id, conversation_id)
+        st.session_state["genie_pending"] = pending
+        st.session_state["genie_pending_key"] = cache_key
+
+    @st.fragment(run_every=1)
+    def genie_status():
+        # Only this fragment reruns while Genie works; a full rerun draws the answer
+        request = st.session_state.get("genie_pending")
+        if request is None:
+            return
+        if request.done():
+            st.rerun()
+        st.markdown(f"⏳ {request.label}... ({request.elapsed:.0f}s)")
+        if st.button("Cancelar", key="genie_cancel"):
+            request.cancel()
+            st.rerun()
+
+    if pending is not None:
+        st.chat_message("user").markdown(pending.question)
+        with st.chat_message("assistant"):
+            genie_status()
 
 
 elif page == "📊 Dashboard":
@@ -564,6 +931,46 @@ elif page == "ℹ️ Sobre":
     </div>
     """, unsafe_allow_html=True)
 
+# ----------------------------------------------------------------
+# PERFORMANCE DEBUG PANEL (OPTIONAL)
+# ----------------------------------------------------------------
+
+def metricsPanel():
+    # This run's stages, then the process totals since startup
+    app_metrics = getMetrics()
+    with st.sidebar.expander("🛠️ Desempenho", expanded=True):
+        events = app_metrics.events(since=RUN_STARTED, thread=threading.get_ident())
+        st.caption("Esta execução")
+        st.dataframe(
+            pd.DataFrame(events, columns=["stage", "ms", "rows", "bytes", "cache"]),
+            hide_index=True, use_container_width=True,
+        )
+        totals = pd.DataFrame.from_dict(app_metrics.totals(), orient="index")
+        if not totals.empty:
+            totals["avg_ms"] = (totals["seconds"] * 1000 / totals["calls"]).round(1)
+            totals["MB"] = (totals["bytes"] / 1024 / 1024).round(2)
+            st.caption("Processo (desde o início)")
+            st.dataframe(totals[["calls", "avg_ms", "rows", "MB", "cache_hits", "cache_misses"]], use_container_width=True)
+        st.download_button("Métricas (Prometheus)", app_metrics.prometheus_text(), "metrics.prom", "text/plain")
+
+        # Footprint of the shared getData() frames: what one more user costs is mostly this
+        import resource
+        store = getResultStore()
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        st.caption(f"Memória: {len(store)} frames, {store.size_bytes / 1024 / 1024:.1f} de {RESULT_CACHE_MB} MB "
+                   f"| pico do processo {peak_mb:,.0f} MB")
+        reports = [frames.memory_report(df) for _, df in store.values()]
+        if reports:
+            st.dataframe(pd.DataFrame([{
+                "rows": r["rows"],
+                "MB": round(r["bytes"] / 1024 / 1024, 2),
+                "bytes/row": r["bytes_per_row"],
+                "dtypes": ", ".join(f"{col}:{c['dtype']}" for col, c in r["columns"].items()),
+            } for r in reports]), hide_index=True, use_container_width=True)
+
+if os.getenv('METRICS_PANEL', 'false').lower() == 'true' and st.sidebar.toggle("Painel de desempenho"):
+    metricsPanel()
+
 # ----------------------------------------------------------------
 # FOOTER
 # ----------------------------------------------------------------
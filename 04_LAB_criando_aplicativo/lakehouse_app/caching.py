@@ -0,0 +1,173 @@
+# ----------------------------------------------------------------
+# IN-PROCESS LRU CACHE
+# ----------------------------------------------------------------
+# Small thread-safe LRU bounded by total size (bytes) and entry count.
+# Used for objects that st.cache_* cannot bound by size, like the
+# multi-megabyte Kepler.gl HTML documents, or that must also expire
+# (Genie answers).
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def default_sizeof(value) -> int:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes: int, max_entries: int = 1024, sizeof=default_sizeof, ttl: float = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self.ttl = ttl   # seconds an entry stays valid (None: until evicted)
+
+        self._entries = OrderedDict()   # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                del self._entries[key]
+                self._bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return   # larger than the whole cache: not worth evicting everything
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def values(self) -> list:
+        # Snapshot (oldest first), without touching the LRU order or the hit counters
+        with self._lock:
+            return [value for value, _, _ in self._entries.values()]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ----------------------------------------------------------------
+# DISK-BACKED RESULT CACHE
+# ----------------------------------------------------------------
+# Query results as Arrow IPC files on local disk, keyed by the query
+# text, its parameters and the table version. Every worker/replica
+# pointing at the same directory shares the entries, and they survive
+# restarts. Files are memory-mapped on read: the pages belong to the OS
+# page cache (shared between processes), not to each worker's heap.
+
+class DiskResultCache:
+
+    SUFFIX = ".arrow"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query: str, parameters: dict = None, version=None) -> str:
+        payload = json.dumps([query, parameters or {}, str(version)], sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str):
+        """Memory-mapped Arrow table of `key`, or None. The buffers point
+        into the mapped file (zero-copy)."""
+        import pyarrow as pa
+        path = self._path(key)
+        try:
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+            os.utime(path)   # mtime = last use, the LRU order shared by every process
+        except (FileNotFoundError, pa.ArrowInvalid):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return table
+
+    def put(self, key: str, table):
+        import pyarrow as pa
+        if table.nbytes > self.max_bytes:
+            return
+        # Written to a private temp file and renamed: readers in other
+        # processes never see a partial entry
+        temp = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            with pa.OSFile(temp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(temp, self._path(key))
+        except OSError:
+            # full or read-only disk: the cache is an optimization, never an error
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used files until the directory fits
+        `max_bytes`. Mapped files stay readable after unlink (POSIX)."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass   # evicted by another worker
+            total -= size
+
+    @property
+    def size_bytes(self) -> int:
+        with os.scandir(self.directory) as it:
+            return sum(e.stat().st_size for e in it if e.name.endswith(self.SUFFIX))
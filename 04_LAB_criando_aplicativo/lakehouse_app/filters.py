@@ -0,0 +1,71 @@
+# ----------------------------------------------------------------
+# CATEGORICAL FILTER INDEX
+# ----------------------------------------------------------------
+# Built once per dataset version (see getFilterIndex() in app.py) so
+# that multiselect interactions never rescan object-dtype strings:
+# each filter value maps to the row positions holding it, a selection
+# is the intersection of the value bitmaps, and the map rows are summed
+# per display group with np.bincount.
+
+import numpy as np
+import pandas as pd
+
+
+class FilterIndex:
+
+    def __init__(self, df: pd.DataFrame, filter_cols: tuple, group_cols: tuple, metrics: tuple):
+        self.n_rows = len(df)
+        self.filter_cols = tuple(filter_cols)
+        self.metrics = tuple(metrics)
+
+        # Sorted option list + row positions of every value, per filter column
+        self.options, self._positions = {}, {}
+        for col in self.filter_cols:
+            codes, uniques = pd.factorize(df[col], sort=True, use_na_sentinel=True)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.options[col] = list(uniques)
+            self._positions[col] = {
+                value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)
+            }
+
+        # Display groups (e.g. h3 [+ bairro, gênero]) the map rows are summed into
+        # observed=True: categorical columns number only the combinations present
+        group_ids = df.groupby(list(group_cols), sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        _, first_rows = np.unique(group_ids, return_index=True)
+        self._group_ids = group_ids
+        self._groups = df[list(group_cols)].iloc[first_rows].reset_index(drop=True)
+        self._values = {m: df[m].to_numpy(dtype="float64", na_value=0.0) for m in self.metrics}
+        self._integer = {m for m in self.metrics if pd.api.types.is_integer_dtype(df[m])}
+
+    def mask(self, selection: dict) -> np.ndarray:
+        """Row bitmap of a selection; empty/missing lists mean "all"."""
+        mask = np.ones(self.n_rows, dtype=bool)
+        for col, values in selection.items():
+            if not values or col not in self._positions:
+                continue
+            dim_mask = np.zeros(self.n_rows, dtype=bool)
+            for value in values:
+                dim_mask[self._positions[col].get(value, slice(0, 0))] = True
+            mask &= dim_mask
+        return mask
+
+    def apply(self, selection: dict, limit: int = None) -> pd.DataFrame:
+        """Display groups with metrics summed over the selected rows.
+
+        Groups without selected rows are dropped; with `limit`, only the
+        groups with the highest first metric are kept.
+        """
+        mask = self.mask(selection)
+        ids = self._group_ids[mask]
+        present = np.bincount(ids, minlength=len(self._groups)) > 0
+        # only the groups present are copied (the index stays shared and read-only)
+        result = self._groups[present].reset_index(drop=True)
+        for metric, values in self._values.items():
+            sums = np.bincount(ids, weights=values[mask], minlength=len(self._groups))[present]
+            result[metric] = sums.round().astype("int64") if metric in self._integer else sums
+
+        if limit and len(result) > limit:
+            top = np.argpartition(-result[self.metrics[0]].to_numpy(), limit - 1)[:limit]
+            result = result.iloc[np.sort(top)]
+        return result.reset_index(drop=True)
@@ -0,0 +1,85 @@
+# ----------------------------------------------------------------
+# COMPACT RESULT FRAMES
+# ----------------------------------------------------------------
+# getData() frames are cached once per table version and shared by
+# every session, so their dtypes decide how many users one replica
+# holds: low-cardinality text becomes categorical (built from Arrow,
+# no Python string objects), numbers are downcast to the narrowest
+# type that keeps their values and H3 ids stay uint64 (hex strings are
+# made only for the map being rendered, see geo.h3_to_hex). Nothing
+# here touches Streamlit.
+
+import numpy as np
+import pandas as pd
+
+# Text columns with at most this share of distinct values become categorical
+CATEGORY_MAX_RATIO = 0.5
+
+# A float column goes to float32 only if no value moves by more than this
+# (half a cent: money columns keep their cents)
+FLOAT32_TOLERANCE = 0.005
+
+
+def is_h3_column(name: str) -> bool:
+    return "h3" in name.lower()
+
+
+def compact_arrow(table) -> pd.DataFrame:
+    """Arrow result -> compact frame, with categoricals decoded straight
+    from Arrow (the text never goes through object columns)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    categories = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_dictionary(column.type):
+            continue   # already categorical after to_pandas
+        if pa.types.is_decimal(column.type):
+            table = table.set_column(table.schema.get_field_index(name), name, column.cast(pa.float64()))
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            if pc.count_distinct(column).as_py() <= CATEGORY_MAX_RATIO * max(1, len(column)):
+                categories.append(name)
+    # split_blocks: one array per column, no consolidation copy
+    return compact_frame(table.to_pandas(categories=categories, split_blocks=True))
+
+
+def compact_series(name: str, series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Arrow keeps first-seen order; sorted categories give sorted options and groups
+        categories = series.cat.categories
+        return series if categories.is_monotonic_increasing else series.cat.reorder_categories(categories.sort_values())
+    if is_h3_column(name) and pd.api.types.is_integer_dtype(series):
+        return series.astype("uint64" if series.notna().all() else "UInt64", copy=False)
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        narrow = values.astype(np.float32)
+        if np.allclose(narrow, values, rtol=0, atol=FLOAT32_TOLERANCE, equal_nan=True):
+            return pd.Series(narrow, index=series.index, name=series.name)
+        return series
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        if series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * max(1, len(series)):
+            return series.astype("category")
+    return series
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Same rows and values in the narrowest dtypes; columns that are
+    already compact are reused as is (no copy)."""
+    compacted = pd.DataFrame({col: compact_series(col, df[col]) for col in df.columns}, copy=False)
+    compacted.attrs.update(df.attrs)
+    return compacted
+
+
+def memory_report(df: pd.DataFrame) -> dict:
+    """Bytes held by a frame, in total and per column (with its dtype)."""
+    usage = df.memory_usage(deep=True, index=True)
+    return {
+        "rows": len(df),
+        "bytes": int(usage.sum()),
+        "bytes_per_row": round(float(usage.sum()) / max(1, len(df)), 1),
+        "columns": {col: {"dtype": str(df[col].dtype), "bytes": int(usage[col])} for col in df.columns},
+    }
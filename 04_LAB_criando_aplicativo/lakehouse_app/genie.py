@@ -0,0 +1,291 @@
+# ----------------------------------------------------------------
+# ASYNC GENIE CLIENT
+# ----------------------------------------------------------------
+# One asyncio loop per app process, on a background thread, runs every
+# Genie conversation. The blocking SDK calls go to a bounded executor
+# and the waits between status polls are asyncio sleeps, so no thread
+# (and no Streamlit script run) is held while Genie thinks. Created once
+# per process (see getGenieClient() in app.py).
+
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+from databricks.sdk.service.dashboards import GenieAPI
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED", "QUERY_RESULT_EXPIRED")
+
+# Message status -> text shown in the chat while the answer is pending
+STATUS_LABELS = {
+    "SUBMITTED": "Pergunta enviada",
+    "FETCHING_METADATA": "Lendo os metadados das tabelas",
+    "FILTERING_CONTEXT": "Selecionando o contexto",
+    "ASKING_AI": "Gerando a consulta",
+    "PENDING_WAREHOUSE": "Aguardando o SQL Warehouse",
+    "EXECUTING_QUERY": "Executando a consulta",
+    "FETCHING_RESULT": "Buscando o resultado",
+    "COMPLETED": "Concluído",
+    "FAILED": "Falhou",
+    "CANCELLED": "Cancelado",
+    "QUERY_RESULT_EXPIRED": "Resultado expirado",
+    "TIMEOUT": "Tempo esgotado",
+}
+
+
+def normalize_question(question: str) -> str:
+    """Cache form of a question: case, accents, punctuation and spacing
+    don't change the answer ("Qual região...?" == "qual regiao ...")."""
+    text = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+# ----------------------------------------------------------------
+# STATEMENT RESULTS AS ARROW
+# ----------------------------------------------------------------
+
+# Manifest type_name -> Arrow type (DECIMAL uses the column precision/scale;
+# anything else, e.g. INTERVAL, ARRAY or MAP, stays as text)
+ARROW_TYPES = {
+    "BOOLEAN": pa.bool_(),
+    "BYTE": pa.int8(),
+    "SHORT": pa.int16(),
+    "INT": pa.int32(),
+    "LONG": pa.int64(),
+    "FLOAT": pa.float32(),
+    "DOUBLE": pa.float64(),
+    "DATE": pa.date32(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),   # JSON cells are ISO-8601 with "Z"
+    "STRING": pa.string(),
+    "CHAR": pa.string(),
+}
+
+
+def arrow_schema(result_schema) -> pa.Schema:
+    fields = []
+    for column in result_schema.columns or ():
+        type_name = column.type_name.value if column.type_name else "STRING"
+        if type_name == "DECIMAL":
+            arrow_type = pa.decimal128(column.type_precision or 38, column.type_scale or 0)
+        else:
+            arrow_type = ARROW_TYPES.get(type_name, pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def json_chunk_to_arrow(data_array, schema: pa.Schema) -> pa.Table:
+    """JSON_ARRAY rows (every cell a string or null) -> typed Arrow table."""
+    columns = list(zip(*data_array)) if data_array else [() for _ in schema]
+    arrays = []
+    for values, field in zip(columns, schema):
+        text = pa.array(values, pa.string())
+        try:
+            arrays.append(text.cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            arrays.append(text)   # unexpected text format: shown as is
+    return pa.Table.from_arrays(arrays, names=schema.names)
+
+
+def download_arrow(link) -> pa.Table:
+    """ARROW_STREAM chunk behind a presigned external link (no workspace auth)."""
+    request = urllib.request.Request(link.external_link, headers=link.http_headers or {})
+    with urllib.request.urlopen(request) as response:
+        return pa.ipc.open_stream(response.read()).read_all()
+
+
+class GenieError(RuntimeError):
+    pass
+
+
+class GenieTimeoutError(TimeoutError):
+    pass
+
+
+class GenieRequest:
+    """Handle of one question: live status, result future and cancel()."""
+
+    def __init__(self, question: str, timeout: float):
+        self.question = question
+        self.timeout = timeout
+        self.status = "SUBMITTED"
+        self.statement_id = None
+        self.started = time.monotonic()
+        self.future = None   # concurrent.futures.Future -> (answer_json, conversation_id)
+
+    @property
+    def label(self) -> str:
+        return STATUS_LABELS.get(self.status, self.status)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self) -> bool:
+        # cancels the coroutine on the loop (see _ask)
+        return self.future.cancel()
+
+
+class GenieClient:
+
+    def __init__(self, workspace_client, max_workers: int = 8, timeout: float = 120,
+                 poll_interval: float = 1.0, max_poll_interval: float = 5.0):
+        self.workspace_client = workspace_client
+        self.genie_api = GenieAPI(workspace_client.api_client)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="genie")
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="genie-loop", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- public API (any thread) ---
+
+    def ask(self, question: str, space_id: str, conversation_id: str = None, timeout: float = None) -> GenieRequest:
+        """Submits a question and returns at once; follow it with the
+        request's status/done() and collect it with result()."""
+        request = GenieRequest(question, timeout or self.timeout)
+        request.future = asyncio.run_coroutine_threadsafe(self._ask(request, space_id, conversation_id), self._loop)
+        return request
+
+    # --- coroutines (background loop) ---
+
+    async def _call(self, function, *args):
+        return await self._loop.run_in_executor(None, function, *args)
+
+    async def _ask(self, request: GenieRequest, space_id: str, conversation_id: str):
+        try:
+            return await asyncio.wait_for(self._converse(request, space_id, conversation_id), request.timeout)
+        except asyncio.TimeoutError:
+            request.status = "TIMEOUT"
+            await self._cancel_statement(request)
+            raise GenieTimeoutError(f"Genie não respondeu em {request.timeout:.0f}s.") from None
+        except asyncio.CancelledError:
+            request.status = "CANCELLED"
+            await self._cancel_statement(request)
+            raise
+
+    async def _converse(self, request: GenieRequest, space_id: str, conversation_id: str):
+        if conversation_id is None:
+            wait = await self._call(self.genie_api.start_conversation, space_id, request.question)
+        else:
+            wait = await self._call(self.genie_api.create_message, space_id, conversation_id, request.question)
+        message = await self._poll(request, space_id, wait.conversation_id, wait.message_id)
+        request.status = "FETCHING_RESULT"
+        answer_json = await self._answer(space_id, message)
+        request.status = "COMPLETED"
+        return answer_json, wait.conversation_id
+
+    async def _poll(self, request: GenieRequest, space_id: str, conversation_id: str, message_id: str):
+        # Backs off from poll_interval to max_poll_interval between status checks
+        interval = self.poll_interval
+        while True:
+            message = await self._call(self.genie_api.get_message, space_id, conversation_id, message_id)
+            request.status = message.status.value if message.status else request.status
+            request.statement_id = self._statement_id(message) or request.statement_id
+            if request.status in TERMINAL_STATUSES:
+                if request.status != "COMPLETED":
+                    error = getattr(message.error, "error", None) or request.label
+                    raise GenieError(error)
+                return message
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, self.max_poll_interval)
+
+    async def _answer(self, space_id: str, message) -> dict:
+        answer_json = {"message": ""}
+        # Possible text attachment
+        for attachment in message.attachments or ():
+            if getattr(attachment, "text", None) and getattr(attachment.text, "content", None):
+                answer_json["message"] = attachment.text.content
+                break
+            if getattr(attachment, "query", None):
+                # The rows themselves are streamed later by iter_result()
+                query_result = await self._call(
+                    self.genie_api.get_message_query_result, space_id, message.conversation_id, message.id
+                ) if hasattr(self.genie_api, "get_message_query_result") else None
+                if query_result and getattr(query_result, "statement_response", None):
+                    answer_json["statement_id"] = query_result.statement_response.statement_id
+                    answer_json["query_description"] = getattr(attachment.query, "description", "")
+                    answer_json["sql"] = getattr(attachment.query, "query", "")
+                    break
+        return answer_json
+
+    # --- statement results (script thread, chunks fetched on the executor) ---
+
+    @staticmethod
+    def _chunk_table(data, schema: pa.Schema) -> pa.Table:
+        if data.external_links:
+            return pa.concat_tables([download_arrow(link) for link in data.external_links])
+        return json_chunk_to_arrow(data.data_array, schema)
+
+    def iter_result(self, statement_id: str, max_rows: int = None, prefetch: int = 4):
+        """Arrow tables of a statement result, chunk by chunk and in order.
+
+        Up to `prefetch` chunks (JSON pages or external Arrow links) are
+        fetched in parallel ahead of the one being consumed; no chunk past
+        `max_rows` is requested. Column types come from the manifest schema.
+        """
+        statement_execution = self.workspace_client.statement_execution
+        statement = statement_execution.get_statement(statement_id)
+        schema = arrow_schema(statement.manifest.schema)
+
+        chunks = sorted(statement.manifest.chunks or (), key=lambda c: c.chunk_index)
+        if max_rows is not None:
+            chunks = [c for c in chunks if (c.row_offset or 0) < max_rows]
+        indexes = deque(c.chunk_index for c in chunks) or deque([0])
+
+        def fetch(index):
+            data = statement.result
+            if data is None or (data.chunk_index or 0) != index:
+                data = statement_execution.get_statement_result_chunk_n(statement_id, index)
+            return self._chunk_table(data, schema)
+
+        running, rows = deque(), 0
+        try:
+            while indexes or running:
+                while indexes and len(running) < prefetch:
+                    running.append(self._executor.submit(fetch, indexes.popleft()))
+                table = running.popleft().result()
+                if max_rows is not None:
+                    table = table.slice(0, max_rows - rows)
+                rows += table.num_rows
+                yield table
+        finally:
+            for future in running:
+                future.cancel()
+
+    @staticmethod
+    def _statement_id(message):
+        for attachment in message.attachments or ():
+            statement_id = getattr(getattr(attachment, "query", None), "statement_id", None)
+            if statement_id:
+                return statement_id
+        return None
+
+    async def _cancel_statement(self, request: GenieRequest):
+        # The Genie API has no message cancel: stop polling and cancel the
+        # warehouse statement Genie started, if it is already known
+        if not request.statement_id:
+            return
+        try:
+            await self._call(self.workspace_client.statement_execution.cancel_execution, request.statement_id)
+        except Exception:
+            pass
@@ -0,0 +1,246 @@
+# ----------------------------------------------------------------
+# H3 / MAP DATA PREPARATION
+# ----------------------------------------------------------------
+# Vectorized helpers shared by the map pages. Nothing here touches
+# Streamlit: caching is done by the wrappers in app.py.
+
+import hashlib
+import math
+
+import numpy as np
+import pandas as pd
+
+# Layout of a 64-bit H3 index: resolution in bits 52-55, then one 3-bit
+# digit per resolution 1..15 (digits below the cell resolution are 7).
+H3_RES_OFFSET = 52
+H3_RES_MASK = 0xF << H3_RES_OFFSET
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+H3_HEX_LENGTH = 15
+_NIBBLE_SHIFTS = (np.arange(H3_HEX_LENGTH - 1, -1, -1, dtype=np.uint64) * np.uint64(4))
+
+
+# Map zoom -> H3 resolution: hexagons stay a few pixels wide on screen
+# (res 9 ~ 0.17 km edge at city zoom, res 5 ~ 8.5 km edge at state zoom).
+ZOOM_RESOLUTIONS = ((11, 9), (9, 8), (8, 7), (7, 6))
+
+
+def resolution_for_zoom(zoom: float, finest: int = 9, coarsest: int = 5) -> int:
+    resolution = next((res for min_zoom, res in ZOOM_RESOLUTIONS if zoom >= min_zoom), coarsest)
+    return max(coarsest, min(finest, resolution))
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a frame (vectorized row hashing, no Python loop)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(",".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def find_h3_column(df: pd.DataFrame):
+    return next((col for col in df.columns if 'h3' in col.lower()), None)
+
+
+def h3_int_to_hex(values) -> np.ndarray:
+    """64-bit H3 ids -> 15-char hex strings, without a per-row Python call.
+
+    Each id is split into 4-bit nibbles with array shifts, the nibbles are
+    mapped to ASCII digits and the byte matrix is viewed as fixed-width
+    strings (same output as format(x, '0>15x')).
+    """
+    ids = np.asarray(values, dtype=np.uint64)
+    nibbles = (ids[:, None] >> _NIBBLE_SHIFTS) & np.uint64(0xF)
+    chars = HEX_DIGITS[nibbles.astype(np.uint8)]
+    return chars.view(f"S{H3_HEX_LENGTH}").ravel().astype(str)
+
+
+def h3_to_hex(series: pd.Series) -> pd.Series:
+    """H3 column (integer ids or hex strings) as hex strings; invalid -> NA.
+    Used at the render edge only: cached frames keep the uint64 ids."""
+    if series.dtype == np.uint64:
+        return pd.Series(h3_int_to_hex(series.to_numpy()), index=series.index, name=series.name, dtype=object)
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_float_dtype(series):
+        valid = series.notna()
+        out = pd.Series(pd.NA, index=series.index, dtype=object)
+        out[valid] = h3_int_to_hex(series[valid].astype("int64"))
+        return out
+    return series.astype("string").str.lower().astype(object)
+
+
+def h3_to_uint64(series: pd.Series) -> pd.Series:
+    """H3 column (integer ids or hex strings) as nullable UInt64 ids;
+    invalid -> NA. uint64 columns are returned as is."""
+    if series.dtype == np.uint64:
+        return series
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_float_dtype(series):
+        return series.astype("UInt64")
+
+    def parse(value):
+        # 15 hex digits (16 with a leading zero); anything else is not an H3 id
+        if not isinstance(value, str) or len(value) not in (H3_HEX_LENGTH, H3_HEX_LENGTH + 1):
+            return None
+        try:
+            return int(value, 16)
+        except ValueError:
+            return None
+
+    return pd.Series([parse(v) for v in series], index=series.index, dtype="UInt64")
+
+
+def with_h3_hex(df: pd.DataFrame, column: str = "h3") -> pd.DataFrame:
+    """Shallow copy of `df` with the H3 ids as hex strings, for the map
+    libraries (Kepler.gl, deck.gl) that only take the string form."""
+    return df.assign(**{column: h3_to_hex(df[column])})
+
+
+def prepare_map_frame(df: pd.DataFrame, numeric_cols=("contagem_clientes", "valor_inadimplencia"),
+                      required=("h3",)) -> pd.DataFrame:
+    """Single preprocessing step for both map pages.
+
+    Builds a frame with the H3 key as uint64 'h3', numeric metrics and
+    without incomplete rows. The input frame is not modified, and its
+    columns are reused without copying when nothing has to be dropped.
+    """
+    h3_column = find_h3_column(df)
+    if not h3_column:
+        raise KeyError("Nenhuma coluna H3 encontrada!")
+    missing = [c for c in (*numeric_cols, *required) if c != 'h3' and c not in df.columns]
+    if missing:
+        raise KeyError(f"Coluna(s) necessária(s) não encontrada(s): {missing}")
+
+    columns = {'h3': h3_to_uint64(df[h3_column])}
+    for col in df.columns:
+        if col == h3_column:
+            continue
+        if col in numeric_cols and not pd.api.types.is_numeric_dtype(df[col]):
+            columns[col] = pd.to_numeric(df[col], errors="coerce")
+        else:
+            columns[col] = df[col]
+    prepared = pd.DataFrame(columns, copy=False)
+
+    subset = list(dict.fromkeys([*required, *[c for c in numeric_cols if c in prepared.columns]]))
+    complete = prepared[subset].notna().all(axis=1).to_numpy()
+    if not complete.all():
+        prepared = prepared[complete].reset_index(drop=True)
+    if prepared['h3'].dtype != np.uint64:
+        prepared['h3'] = prepared['h3'].astype("uint64")
+    return prepared
+
+
+# ----------------------------------------------------------------
+# PYDECK TRANSPORT
+# ----------------------------------------------------------------
+
+def fill_colors(values, max_value: float = None, alpha: int = 180) -> np.ndarray:
+    """RGBA uint8 per row, yellow -> red as `values` grow (server-side
+    version of "[255, 255 * (1 - v / max), 0, alpha]")."""
+    values = np.asarray(values, dtype="float64")
+    max_value = max_value or (np.nanmax(values) if len(values) else 1) or 1
+    colors = np.empty((len(values), 4), dtype=np.uint8)
+    colors[:, 0] = 255
+    colors[:, 1] = np.clip(255 * (1 - values / max_value), 0, 255)
+    colors[:, 2] = 0
+    colors[:, 3] = alpha
+    return colors
+
+
+def deck_frame(df: pd.DataFrame, color_col: str, elevation_col: str, tooltip_cols=(), decimals: int = 2) -> pd.DataFrame:
+    """Minimal frame for the H3HexagonLayer: hexagon, elevation, precomputed
+    color and tooltip fields only, floats rounded to shrink the JSON."""
+    frame = {"h3": h3_to_hex(df["h3"]).to_numpy(), elevation_col: df[elevation_col].round(decimals).to_numpy()}
+    # one vectorized tolist(): deck.gl reads the [r, g, b, a] arrays as is
+    frame["color"] = fill_colors(df[color_col].to_numpy()).tolist()
+    for col in tooltip_cols:
+        if col in df.columns and col not in frame:
+            values = df[col]
+            frame[col] = values.round(decimals).to_numpy() if pd.api.types.is_float_dtype(values) else values.to_numpy()
+    return pd.DataFrame(frame)
+
+
+# ----------------------------------------------------------------
+# VIEWPORT -> H3 KEY RANGES
+# ----------------------------------------------------------------
+
+def viewport_bbox(latitude: float, longitude: float, zoom: float,
+                  width_px: int = 1200, height_px: int = 600) -> tuple:
+    """(south, west, north, east) visible around a web-mercator view."""
+    meters_per_px = 156543.03392 * math.cos(math.radians(latitude)) / (2 ** zoom)
+    half_h = height_px / 2 * meters_per_px / 111_320
+    half_w = width_px / 2 * meters_per_px / (111_320 * math.cos(math.radians(latitude)))
+    return (latitude - half_h, longitude - half_w, latitude + half_h, longitude + half_w)
+
+
+def bbox_cell_estimate(bbox: tuple, resolution: int) -> float:
+    """Approximate number of H3 cells at `resolution` covering the bbox
+    (box area / average cell area), computed without touching any cell."""
+    import h3
+
+    south, west, north, east = bbox
+    height_km = (north - south) * 111.32
+    width_km = (east - west) * 111.32 * math.cos(math.radians((north + south) / 2))
+    return abs(height_km * width_km) / h3.average_hexagon_area(resolution, unit="km^2")
+
+
+def cover_bbox(bbox: tuple, resolution: int) -> list:
+    """Integer ids of the H3 cells at `resolution` touching the bbox.
+
+    Samples the box at half the cell edge and adds one ring around the
+    hits, so cells only clipped by the border are included too.
+    """
+    import h3
+
+    south, west, north, east = bbox
+    step = math.degrees(h3.average_hexagon_edge_length(resolution, unit="km") / 6371.0) / 2
+    lat_steps = max(2, int((north - south) / step) + 2)
+    lng_steps = max(2, int((east - west) / (step / max(0.1, math.cos(math.radians((north + south) / 2))))) + 2)
+
+    hits = {
+        h3.latlng_to_cell(lat, lng, resolution)
+        for lat in np.linspace(south, north, lat_steps)
+        for lng in np.linspace(west, east, lng_steps)
+    }
+    cells = set()
+    for cell in hits:
+        cells.update(h3.grid_disk(cell, 1))
+    return sorted(h3.str_to_int(c) for c in cells)
+
+
+def descendant_range(parent: int, parent_resolution: int, child_resolution: int) -> tuple:
+    """[low, high] integer interval holding every descendant of `parent`
+    at `child_resolution`: the digits between the two resolutions are the
+    only bits that vary, so the children are contiguous ids."""
+    varying = ((1 << (3 * (15 - parent_resolution))) - 1) ^ ((1 << (3 * (15 - child_resolution))) - 1)
+    low = ((parent & ~H3_RES_MASK) | (child_resolution << H3_RES_OFFSET)) & ~varying
+    return low, low | varying
+
+
+def viewport_ranges(bbox: tuple, child_resolution: int = 9, max_ranges: int = 64,
+                    finest_index: int = 7, coarsest_index: int = 3) -> tuple:
+    """Merged id ranges of the gold cells inside the bbox.
+
+    Covers the box with the finest index resolution that stays within
+    `max_ranges` parent cells; each parent becomes one BETWEEN on the
+    H3 key, and adjacent intervals are merged. Returns () when the view is
+    too wide for a range filter to pay off (no filter is applied).
+
+    Resolutions whose estimated cell count already exceeds `max_ranges`
+    are skipped before sampling: a wide view at a fine resolution would
+    cost millions of point lookups just to be discarded.
+    """
+    for index_resolution in range(finest_index, coarsest_index - 1, -1):
+        if bbox_cell_estimate(bbox, index_resolution) > max_ranges:
+            continue
+        parents = cover_bbox(bbox, index_resolution)
+        if len(parents) <= max_ranges:
+            break
+    else:
+        return ()
+
+    ranges = []
+    for low, high in sorted(descendant_range(p, index_resolution, child_resolution) for p in parents):
+        if ranges and low <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], high))
+        else:
+            ranges.append((low, high))
+    return tuple(ranges)
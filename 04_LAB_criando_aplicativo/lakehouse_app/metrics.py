@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------
+# PER-STAGE PERFORMANCE METRICS
+# ----------------------------------------------------------------
+# Process-wide counters per stage (warehouse query, pandas conversion,
+# H3 formatting, map serialization, Genie...): calls, seconds, rows,
+# bytes and cache hits/misses. Exposed as a sidebar debug panel (see
+# metricsPanel() in app.py), one JSON log line per event and a
+# Prometheus text file. Nothing here touches Streamlit.
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("lakehouse_app.metrics")
+
+COUNTERS = ("calls", "seconds", "rows", "bytes", "cache_hits", "cache_misses")
+
+
+class Metrics:
+
+    def __init__(self, log_json: bool = False, prometheus_file: str = None,
+                 prometheus_interval: float = 15, max_events: int = 500):
+        self.log_json = log_json
+        self.prometheus_file = prometheus_file
+        self.prometheus_interval = prometheus_interval
+
+        self._totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+
+        if log_json and not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+    def record(self, stage: str, seconds: float, rows: int = None, nbytes: int = None, cache: str = None, **fields):
+        """One finished stage. `cache` is "hit", "miss" or any other
+        outcome label (e.g. "delta"); only hit/miss are counted."""
+        event = {"ts": round(time.time(), 3), "stage": stage, "ms": round(seconds * 1000, 2),
+                 "thread": threading.get_ident()}
+        if rows is not None:
+            event["rows"] = int(rows)
+        if nbytes is not None:
+            event["bytes"] = int(nbytes)
+        if cache is not None:
+            event["cache"] = cache
+        event.update(fields)
+
+        with self._lock:
+            totals = self._totals[stage]
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            totals["rows"] += rows or 0
+            totals["bytes"] += nbytes or 0
+            totals["cache_hits"] += cache == "hit"
+            totals["cache_misses"] += cache == "miss"
+            self._events.append(event)
+            write_prometheus = (self.prometheus_file
+                                and time.monotonic() - self._written_at >= self.prometheus_interval)
+            if write_prometheus:
+                self._written_at = time.monotonic()
+
+        if self.log_json:
+            logger.info(json.dumps(event, default=str))
+        if write_prometheus:
+            self.write_prometheus()
+
+    @contextmanager
+    def timed(self, stage: str, **fields):
+        """Times the block; set "rows", "nbytes" or "cache" on the yielded
+        dict to record them too."""
+        span = dict(fields)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self.record(stage, time.perf_counter() - started, **span)
+
+    # --- views ---
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {stage: dict(values) for stage, values in self._totals.items()}
+
+    def events(self, since: float = 0.0, thread: int = None) -> list:
+        with self._lock:
+            return [e for e in self._events
+                    if e["ts"] >= since and (thread is None or e["thread"] == thread)]
+
+    def prometheus_text(self, prefix: str = "lakehouse_app") -> str:
+        lines = []
+        totals = self.totals()
+        for counter in COUNTERS:
+            name = f"{prefix}_stage_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for stage, values in sorted(totals.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {values[counter]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        # Atomic rewrite, for the node_exporter textfile collector or a sidecar
+        temp = f"{self.prometheus_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(temp, self.prometheus_file)
+        except OSError:
+            logger.warning("Could not write metrics to %s", self.prometheus_file)
@@ -0,0 +1,187 @@
+# ----------------------------------------------------------------
+# QUERY BUILDER FOR THE GOLD TABLE
+# ----------------------------------------------------------------
+# Builds parameterized SELECTs so each page pulls only the columns it
+# uses, with the multiselect filters applied on the warehouse.
+# Identifiers are validated against the known gold columns; filter
+# values always travel as named parameters (never formatted into SQL).
+
+import os
+
+import pandas as pd
+
+H3_RESOLUTION = 9                     # grain of the gold table
+H3_COLUMN = "h3_09_id"
+
+# Parent keys materialized in the gold table (lab01_gold_h3 writes 9,8,7;
+# the SQL of LAB 04 only 9). Other resolutions use h3_toparent().
+H3_STORED_RESOLUTIONS = tuple(int(r) for r in os.getenv("GOLD_H3_RESOLUTIONS", "9").split(","))
+
+DIMENSIONS = ("genero_cliente", "bairro", "faixa_divida")
+METRICS = ("contagem_clientes", "valor_inadimplencia")
+
+GOLD_COLUMNS = (H3_COLUMN, *DIMENSIONS, *METRICS)
+
+# Aggregate cube (lab01_gold_h3 -> gold_faturamento_cubo): same dimensions
+# and metrics as the gold table, plus the location of the clients
+CUBE_DIMENSIONS = ("uf", "cidade", *DIMENSIONS)
+
+
+def _check_columns(columns):
+    unknown = [c for c in columns if c not in GOLD_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown gold column(s): {unknown}")
+
+
+def h3_column(resolution: int) -> str:
+    return f"h3_{resolution:02d}_id"
+
+
+def h3_expression(resolution: int) -> str:
+    """SQL for the H3 cell at `resolution`, rolled up from the gold grain."""
+    if not 0 <= resolution <= H3_RESOLUTION:
+        raise ValueError(f"H3 resolution must be between 0 and {H3_RESOLUTION}")
+    if resolution in H3_STORED_RESOLUTIONS:
+        return h3_column(resolution)
+    return f"h3_toparent({H3_COLUMN}, {int(resolution)})"
+
+
+def normalize_filters(filters: dict) -> tuple:
+    """Hashable, order-independent form of the filter selection.
+
+    Empty selections mean "no filter" and are dropped, so equivalent
+    selections share one cache entry.
+    """
+    _check_columns(filters)
+    return tuple(sorted(
+        (column, tuple(sorted(set(values))))
+        for column, values in filters.items() if values
+    ))
+
+
+def where_clause(filters: tuple, h3_ranges: tuple = ()) -> tuple:
+    """Returns (sql, parameters) for normalized filters.
+
+    `h3_ranges` are (low, high) intervals of gold H3 ids (see
+    geo.viewport_ranges); they become BETWEENs on the H3 key so a table
+    clustered by it only reads the files of the visible area.
+    """
+    conditions, parameters = [], {}
+    for column, values in filters:
+        names = [f"{column}_{i}" for i in range(len(values))]
+        conditions.append(f"{column} IN ({', '.join(':' + n for n in names)})")
+        parameters.update(zip(names, values))
+    if h3_ranges:
+        between = []
+        for i, (low, high) in enumerate(h3_ranges):
+            between.append(f"{H3_COLUMN} BETWEEN :h3_low_{i} AND :h3_high_{i}")
+            parameters.update({f"h3_low_{i}": int(low), f"h3_high_{i}": int(high)})
+        conditions.append(f"({' OR '.join(between)})")
+    sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return sql, parameters
+
+
+def build_select(table: str, columns: tuple, filters: tuple = (), group_by: tuple = (),
+                 resolution: int = H3_RESOLUTION, limit: int = None, h3_ranges: tuple = (),
+                 metric_sql: str = "SUM({c})") -> tuple:
+    """SELECT of `columns` from `table`.
+
+    With `group_by`, metric columns are summed over the remaining grain
+    (e.g. group by h3 + bairro to collapse gender and debt band). A
+    coarser `resolution` rolls the H3 cells up to their parents (the
+    result column is then h3_<res>_id) and always aggregates. `limit`
+    keeps the cells with the highest first metric; `h3_ranges` restricts
+    the result to a viewport.
+    """
+    _check_columns(columns)
+    _check_columns(group_by)
+    where, parameters = where_clause(filters, h3_ranges)
+
+    if resolution != H3_RESOLUTION and not group_by:
+        group_by = tuple(c for c in columns if c not in METRICS)
+
+    def expr(c):
+        return h3_expression(resolution) if c == H3_COLUMN else c
+
+    def named(c):
+        return c if expr(c) == c else f"{expr(c)} AS {h3_column(resolution)}"
+
+    if group_by:
+        select = [named(c) for c in columns if c in group_by]
+        select += [f"{metric_sql.format(c=c)} AS {c}" for c in columns if c in METRICS]
+        group = f"GROUP BY {', '.join(expr(c) for c in group_by)}"
+    else:
+        select, group = list(columns), ""
+
+    order = ""
+    if limit:
+        metric = next((c for c in columns if c in METRICS), None)
+        order = f"ORDER BY {metric} DESC " if metric else ""
+        order += f"LIMIT {int(limit)}"
+
+    query = f"SELECT {', '.join(select)} FROM {table} {where} {group} {order}".strip()
+    return " ".join(query.split()), parameters
+
+
+# Change data feed rows weigh +1 (insert / update_postimage) or -1
+# (delete / update_preimage): summing them gives the delta of each aggregate.
+SIGNED_SUM = "SUM(CASE WHEN _change_type IN ('delete', 'update_preimage') THEN -{c} ELSE {c} END)"
+
+
+def build_version(table: str) -> str:
+    return f"DESCRIBE HISTORY {table} LIMIT 1"
+
+
+def build_changes(table: str, columns: tuple, from_version: int, to_version: int, filters: tuple = (),
+                  group_by: tuple = (), resolution: int = H3_RESOLUTION, h3_ranges: tuple = ()) -> tuple:
+    """Same shape as build_select(), but returning the signed change of each
+    group between two Delta versions (read from the change data feed)."""
+    group_by = group_by or tuple(c for c in columns if c not in METRICS)
+    source = f"table_changes('{table}', {int(from_version) + 1}, {int(to_version)})"
+    return build_select(source, columns, filters, group_by, resolution, None, h3_ranges, SIGNED_SUM)
+
+
+def merge_changes(cached: pd.DataFrame, changes: pd.DataFrame) -> pd.DataFrame:
+    """Applies build_changes() deltas to a cached aggregate frame.
+
+    Groups are matched on the non-metric columns; groups whose client
+    count drops to zero (all rows deleted) leave the frame. Metric sums
+    keep a wide dtype and categorical keys come back as plain values:
+    compact the result again (frames.compact_frame) before caching it.
+    """
+    keys = [c for c in cached.columns if c not in METRICS]
+    metrics = [c for c in cached.columns if c in METRICS]
+    # same key dtypes on both sides (e.g. uint64 H3 ids), or concat falls back to float
+    key_dtypes = {c: t for c, t in cached.dtypes.items() if c in keys and not isinstance(t, pd.CategoricalDtype)}
+    merged = (
+        pd.concat([cached, changes[cached.columns].astype(key_dtypes)], ignore_index=True)
+        .groupby(keys, sort=False, dropna=False, observed=True, as_index=False)[metrics].sum()
+    )
+    if "contagem_clientes" in merged.columns:
+        merged = merged[merged["contagem_clientes"] > 0]
+    return merged.astype(key_dtypes).reset_index(drop=True)
+
+
+def build_totals(table: str, filters: tuple = ()) -> tuple:
+    where, parameters = where_clause(filters)
+    select = ", ".join(f"SUM({c}) AS {c}" for c in METRICS)
+    return " ".join(f"SELECT {select} FROM {table} {where}".split()), parameters
+
+
+def build_breakdown(table: str, dimension: str, filters: tuple = ()) -> tuple:
+    """Metrics summed per value of one dimension (dashboard tiles)."""
+    if dimension not in CUBE_DIMENSIONS:
+        raise ValueError(f"Unknown cube dimension: {dimension}")
+    where, parameters = where_clause(filters)
+    select = ", ".join(f"SUM({c}) AS {c}" for c in METRICS)
+    query = f"SELECT {dimension}, {select} FROM {table} {where} GROUP BY {dimension} ORDER BY {dimension}"
+    return " ".join(query.split()), parameters
+
+
+def build_options(table: str, dimensions: tuple = DIMENSIONS) -> str:
+    """Distinct values of each dimension in a single round trip (dim, value)."""
+    _check_columns(dimensions)
+    return " UNION ALL ".join(
+        f"SELECT '{d}' AS dim, CAST({d} AS STRING) AS value FROM {table} WHERE {d} IS NOT NULL GROUP BY {d}"
+        for d in dimensions
+    )
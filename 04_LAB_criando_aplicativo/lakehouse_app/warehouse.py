@@ -0,0 +1,157 @@
+# ----------------------------------------------------------------
+# SQL WAREHOUSE CONNECTION POOL
+# ----------------------------------------------------------------
+# Keeps a small set of open Databricks SQL connections so queries skip
+# the OAuth + session handshake. Created once per app process (see
+# getPool() in app.py) and shared by every session and rerun.
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+from databricks import sql
+from databricks.sdk.core import Config
+from databricks.sql.exc import InterfaceError, OperationalError
+
+# Connection-level failures (expired token, closed session, network):
+# the connection is discarded and the query retried once on a new one.
+# SQL errors (ServerOperationError) are raised as is.
+RECONNECT_ERRORS = (OperationalError, InterfaceError)
+
+
+class QueryTimeoutError(TimeoutError):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, warehouse_id: str, size: int = 4, query_timeout: int = 60,
+                 acquire_timeout: int = 30, health_check_interval: int = 300):
+        self.cfg = Config()
+        self.http_path = f"/sql/1.0/warehouses/{warehouse_id}"
+        self.size = size
+        self.query_timeout = query_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    # --- connection lifecycle ---
+
+    def _connect(self):
+        connection = sql.connect(
+            server_hostname=self.cfg.host,
+            http_path=self.http_path,
+            credentials_provider=lambda: self.cfg.authenticate,
+            # server-side guard; the client-side timer in query() cancels earlier if asked
+            session_configuration={"STATEMENT_TIMEOUT": str(self.query_timeout)},
+        )
+        return {"connection": connection, "checked_at": time.monotonic()}
+
+    def _close(self, entry):
+        try:
+            entry["connection"].close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def _healthy(self, entry) -> bool:
+        connection = entry["connection"]
+        if not getattr(connection, "open", True):
+            return False
+        if time.monotonic() - entry["checked_at"] < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            entry["checked_at"] = time.monotonic()
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No SQL connection available after {self.acquire_timeout}s (pool size {self.size}).")
+                try:
+                    entry = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+            if self._healthy(entry):
+                return entry
+            self._close(entry)
+
+    @contextmanager
+    def connection(self):
+        entry = self._acquire()
+        try:
+            yield entry["connection"]
+        except RECONNECT_ERRORS:
+            self._close(entry)
+            raise
+        except BaseException:
+            self._idle.put(entry)
+            raise
+        else:
+            self._idle.put(entry)
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    # --- queries ---
+
+    def _execute(self, query: str, parameters, timeout):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                timer = threading.Timer(timeout, cursor.cancel) if timeout else None
+                if timer:
+                    timer.start()
+                started = time.monotonic()
+                try:
+                    cursor.execute(query, parameters)
+                    return cursor.fetchall_arrow()
+                except Exception as e:
+                    if timeout and time.monotonic() - started >= timeout:
+                        raise QueryTimeoutError(f"Query cancelled after {timeout}s.") from e
+                    raise
+                finally:
+                    if timer:
+                        timer.cancel()
+
+    def query_arrow(self, query: str, parameters: dict = None, timeout: int = None) -> pa.Table:
+        timeout = timeout or self.query_timeout
+        try:
+            return self._execute(query, parameters, timeout)
+        except RECONNECT_ERRORS:
+            # stale session or expired credentials: retry once on a fresh connection
+            return self._execute(query, parameters, timeout)
+
+    def query(self, query: str, parameters: dict = None, timeout: int = None) -> pd.DataFrame:
+        return self.query_arrow(query, parameters, timeout).to_pandas()